@@ -1,12 +1,22 @@
+import os
+import sys
 import numpy as np
 from alt_acmnICA import *
 from alt_FDICA import *
 from alt_jadeICA import *
 from perm_align_algos import *
 from utils import *
+from segmenter import stft_segments
 import matplotlib.pyplot as plt
 from scipy import signal
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Sources', 'FDICA'))
+from parallel_ import map_shards
+from fdica_ import _ica_by_freq, _correct_split_permutation
+
+#None runs the ICA of every segment in this process, 'process' shards the segments across all cores
+executor = None
+
 #Read the data
 data_path = '/Users/stephankrauskopf/Documents/Python_MA/RawData.csv'
 
@@ -48,10 +58,6 @@ filtered_ir_vec2 = signal.lfilter(taps2,1.0,IR_raw)
 R_normalized = np.divide(filtered_red_vec2, filtered_red_vec1) * (-1)
 IR_normalized = np.divide(filtered_ir_vec2, filtered_ir_vec1) * (-1)
 
-#Overlapp add to split up the segments
-oa_R = overlap_add(R_normalized)
-oa_IR = overlap_add(IR_normalized)
-
 demixed_R_acmn = []
 demixed_IR_acmn = []
 demixed_R_fdica = []
@@ -59,32 +65,82 @@ demixed_IR_fdica = []
 demixed_R_jade = []
 demixed_IR_jade = []
 
-#Blind Source Seperation
-for i in range(len(oa_R)):
-    f_R, t_R, Zxx_R = signal.stft(oa_R[i], fs, nperseg=32, noverlap=24)
-    f_IR, t_IR, Zxx_IR = signal.stft(oa_IR[i], fs, nperseg=32, noverlap=24)
-
-
-    #ICA algorithms
-    #Adaptable ICA algorithm based on complex generalized Gaussian distribution
+#ICA algorithms on a stack of segment spectrograms, shape (n_segments, n_bins, n_frames)
+def separate_segments(Zxx):
+    acmn_S = np.empty_like(Zxx)
+
+    for k in range(len(Zxx)):
+        #Adaptable ICA algorithm based on complex generalized Gaussian distribution
+        """
+        W: array, shape (n_components, n_components)
+        Estimated un-mixing matrix.
+        K : array, shape (n_components, n_features)
+        Sphering Matrix
+        A : array, shape(n_components,max_iter)
+        Complex valued mixing Matrix
+        S : array, shape (n_samples, n_components)
+        Estimated sources (S = W K X).
+        """
+        acmn_A,acmn_S[k],acmn_K,acmn_W = ACMNsym(Zxx[k])
+
+        #ncmn_A,ncmn_S,ncmn_K,ncmn_W = ACMNsym(Zxx[k],model='noncirc')
+
+    #Source separation of complex signals via Joint Approximate Diagonalization of Eigen-matrices, all segments at once
     """
-    W: array, shape (n_components, n_components)
-    Estimated un-mixing matrix.
-    K : array, shape (n_components, n_features)
-    Sphering Matrix
-    A : array, shape(n_components,max_iter)
-    Complex valued mixing Matrix
-    S : array, shape (n_samples, n_components)
-    Estimated sources (S = W K X).
+    A : array, shape (n_segments, n_mixtures, n_sources) 
+    Estimate of the mixing matrix
+    S : array, shape (n_segments, n_sources, n_samples) 
+    Estimate of the source signals
+    V : array, shape (n_segments, n_sources, n_mixtures)
+    Estimate of the un-mixing matrix
+    W : array, shape (n_segments, n_components, n_mixtures)
+    Sphering matrix
     """
-    acmn_R_A,acmn_R_S,acmn_R_K,acmn_R_W = ACMNsym(Zxx_R)
-    acmn_IR_A,acmn_IR_S,acmn_IR_K,acmn_IR_W = ACMNsym(Zxx_IR)
-    
-    demixed_IR_acmn.extend(perm_al_hof_alg1(acmn_IR_S))
-    demixed_R_acmn.extend(perm_al_hof_alg1(acmn_R_S))
+    jade_A,jade_S,jade_W,jade_V = jade_batch(Zxx)
 
-    #ncmn_R_A,ncmn_R_S,ncmn_R_K,ncmn_R_W = ACMNsym(Zxx_R,model='noncirc')
-    #ncmn_IR_A,ncmn_IR_S,ncmn_IR_K,ncmn_IR_W = ACMNsym(Zxx_IR,model='noncirc')
+    return acmn_S, jade_S
+
+#Blind Source Seperation
+#STFT of the whole recording once, split up into the frames of the overlapping segments (256/128, bartlett-window)
+f_R, t_R, Zxx_R_segments = stft_segments(R_normalized, fs, 256, 128, nperseg=32, noverlap=24)
+f_IR, t_IR, Zxx_IR_segments = stft_segments(IR_normalized, fs, 256, 128, nperseg=32, noverlap=24)
+
+#ICA of every segment, either in this process or sharded across worker processes
+#(ACMN and JADE use the bins of a segment as mixtures, so all bins are kept)
+if executor == 'process':
+    out_specs = [(Zxx_R_segments.shape[1:], Zxx_R_segments.dtype)] * 2
+    acmn_R_segments, jade_R_segments = map_shards(separate_segments, Zxx_R_segments, out_specs)
+    acmn_IR_segments, jade_IR_segments = map_shards(separate_segments, Zxx_IR_segments, out_specs)
+else:
+    acmn_R_segments, jade_R_segments = separate_segments(Zxx_R_segments)
+    acmn_IR_segments, jade_IR_segments = separate_segments(Zxx_IR_segments)
+
+#FDICA solves one mixture per bin, only the bins inside the passband of the bandpass filter are separated,
+#the other bins carry no pulse and are passed through unchanged ('pass') or set to zero ('zero')
+out_of_band = 'pass'
+band_bins = (f_R >= Filterband[0]) & (f_R <= Filterband[1])
+bss_bins = {'band': Filterband, 'bins': np.flatnonzero(band_bins), 'frequencies': f_R[band_bins],
+            'out_of_band': out_of_band}
+
+#Frequency domain ICA of the two channels (R, IR): every (segment, bin) mixture is solved in one batch,
+#the permutations are aligned per segment by the correlation of the amplitude envelopes of the in-band bins
+n_segments, n_bins, n_frames = Zxx_R_segments.shape
+S = np.stack([Zxx_R_segments, Zxx_IR_segments]).transpose(0, 3, 1, 2).reshape(2, n_frames, n_segments * n_bins)
+T, WK = _ica_by_freq(S, executor, bins=np.tile(band_bins, n_segments), out_of_band=out_of_band)
+T = T.reshape(2, n_frames, n_segments, n_bins)
+WK = WK.reshape(2, 2, n_segments, n_bins)
+
+fdica_R_segments = np.empty_like(Zxx_R_segments)
+fdica_IR_segments = np.empty_like(Zxx_IR_segments)
+for i in range(n_segments):
+    V = _correct_split_permutation(T[:, :, i], WK[:, :, i], method='envelope', bins=band_bins)
+    fdica_R_segments[i], fdica_IR_segments[i] = V[0].T, V[1].T
+    demixed_R_fdica.extend(fdica_R_segments[i])
+    demixed_IR_fdica.extend(fdica_IR_segments[i])
+
+for i in range(len(Zxx_R_segments)):
+    demixed_IR_acmn.extend(perm_al_hof_alg1(acmn_IR_segments[i]))
+    demixed_R_acmn.extend(perm_al_hof_alg1(acmn_R_segments[i]))
 
     #A fast fixed-point algorithm for independent component analysis of complex valued signals
     """
@@ -100,30 +156,21 @@ for i in range(len(oa_R)):
     S : array, shape (n_samples, n_components)
     Estimated sources (S = W K X).
     
-    fdica_R_K,fdica_R_W,fdica_R_S,fdica_R_EG= complex_FastICA(Zxx_R)
-    fdica_IR_K,fdica_IR_W,fdica_IR_S,fdica_IR_EG= complex_FastICA(Zxx_IR)
+    fdica_R_K,fdica_R_W,fdica_R_S,fdica_R_EG= complex_FastICA(Zxx_R_segments[i])
+    fdica_IR_K,fdica_IR_W,fdica_IR_S,fdica_IR_EG= complex_FastICA(Zxx_IR_segments[i])
 
     for k in range(len(fdica_R_S)):
         demixed_R_fdica.extend(permutation_correction(fdica_R_S[k]))
         demixed_IR_fdica.extend(permutation_correction(fdica_IR_S[k]))
    """
 
-    #Source separation of complex signals via Joint Approximate Diagonalization of Eigen-matrices
-    """
-    A : array, shape (n_mixtures, n_sources) 
-    Estimate of the mixing matrix
-    S : array, shape (n_sources, n_samples) 
-    Estimate of the source signals
-    V : array, shape (n_sources, n_mixtures)
-    Estimate of the un-mixing matrix
-    W : array, shape (n_components, n_mixtures)
-    Sphering matrix
-    """
-    jadeICA_R_A,jadeICA_R_S,jadeICA_R_W,jadeICA_R_V = jade(Zxx_R)
-    jadeICA_IR_A,jadeICA_IR_S,jadeICA_IR_W,jadeICA_IR_V = jade(Zxx_IR)
+    demixed_IR_jade.extend(perm_al_hof_alg1(jade_IR_segments[i]))
+    demixed_R_jade.extend(perm_al_hof_alg1(jade_R_segments[i]))
 
-    demixed_IR_jade.extend(perm_al_hof_alg1(jadeICA_IR_S))
-    demixed_R_jade.extend(perm_al_hof_alg1(jadeICA_R_S))
+#Last segment for the plots
+Zxx_R, acmn_R_S, jadeICA_R_S = Zxx_R_segments[-1], acmn_R_segments[-1], jade_R_segments[-1]
+Zxx_IR, acmn_IR_S, jadeICA_IR_S = Zxx_IR_segments[-1], acmn_IR_segments[-1], jade_IR_segments[-1]
+fdica_R_S, fdica_IR_S = fdica_R_segments[-1], fdica_IR_segments[-1]
 
 
 
@@ -145,6 +192,10 @@ plot_spectrum(Zxx_IR,t_IR,f_IR)
 plot_spectrum(jadeICA_IR_S,t_IR,f_IR)
 plot_spectrum(demixed_IR_jade,t_IR,f_IR)
 
+#FDICA spectral plot - envelope alignment
+plot_spectrum(fdica_R_S,t_R,f_R)
+plot_spectrum(fdica_IR_S,t_IR,f_IR)
+
 '''
 Split_spec_R = _get_split_spectrum(T_R,WK_R)
 Split_spec_IR = _get_split_spectrum(T_IR,WK_IR)
@@ -1,8 +1,13 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
 from scipy import signal
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from whitening import whitening_matrix
+
 
 #This is a simple subtraction of the mean from our input X. As a result the centered mixed signals will have zero mean which implies that also our source signals s are of zero mean.
 def center(x):
@@ -20,17 +25,8 @@ def covariance(x):
 
 #The goal here is to linearly transform the observed signals X in a way that potential correlations between the signals are removed and their variances equal unity
 def whiten(x):
-    # Calculate the covariance matrix
-    coVarM = covariance(x) 
-    
-    # Single value decoposition
-    U, S, V = np.linalg.svd(coVarM)
-    
-    # Calculate diagonal matrix of eigenvalues
-    d = np.diag(1.0 / np.sqrt(S)) 
-    
-    # Calculate whitening matrix
-    whiteM = np.dot(U, np.dot(d, U.T))
+    # Calculate whitening matrix U * S^(-1/2) * U.T from the eigendecomposition of the covariance matrix
+    whiteM = whitening_matrix(x, method='zca', ddof=1)[0]
     
     # Project onto whitening matrix
     Xw = np.dot(whiteM, x) 
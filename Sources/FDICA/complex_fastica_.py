@@ -10,6 +10,7 @@ Independent Component Analysis, by  Hyvarinen et al.
 import warnings
 import numpy as np
 from scipy.linalg import eigh
+import os
 import sys
 import six
 from sklearn.base import BaseEstimator, TransformerMixin
@@ -18,7 +19,10 @@ from sklearn.utils.extmath import *
 from sklearn.utils.validation import check_is_fitted
 from sklearn.utils.validation import FLOAT_DTYPES
 
-__all__ = ['complexfastica', 'ComplexFastICA']
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from whitening import whitening_matrix
+
+__all__ = ['complexfastica', 'complexfastica_batch', 'ComplexFastICA']
 
 def _sym_decorrelation(W):
     """ Symmetric decorrelation
@@ -55,6 +59,54 @@ def _ica_par(X, tol, g, fun_args, max_iter, w_init):
 
     return W, ii + 1
 
+def _sym_decorrelation_batch(W):
+    """ Symmetric decorrelation of a stack of matrices
+    i.e. W[f] <- (W[f] * W[f].H) ^{-1/2} * W[f] for every f
+    """
+    s, u = np.linalg.eigh(np.matmul(W, np.conj(W.swapaxes(-1, -2))))
+    s = np.where(s<1.e-10,1.e-10,s)
+    return np.matmul(np.matmul(u * (1. / np.sqrt(s))[..., np.newaxis, :],
+                               np.conj(u.swapaxes(-1, -2))), W)
+
+def _ica_par_batch(X, tol, g, fun_args, max_iter, w_init):
+    """Parallel FastICA on a stack of independent problems.
+    Used internally by complexfastica_batch --main loop
+    X has shape (n_problems, n_components, p). Problems that have converged
+    are masked out, so later iterations only touch the remaining ones.
+    """
+    W = _sym_decorrelation_batch(w_init)
+    del w_init
+
+    n_problems, n, p = X.shape
+    p_ = float(p)
+    n_iter = np.zeros(n_problems, dtype=int)
+    active = np.arange(n_problems)
+    for ii in range(max_iter):
+        Xa = X[active]
+        Wa = W[active]
+        U = np.matmul(Wa, Xa)
+        # g works on 2-D arrays, so flatten the stack into rows
+        gwtx, g_wtx = g((np.abs(U)**2).reshape(-1, p), fun_args)
+        gwtx = gwtx.reshape(U.shape)
+        g_wtx = g_wtx.reshape(U.shape[:2])
+
+        W1 = _sym_decorrelation_batch(
+            np.matmul(gwtx * U, np.conj(Xa.swapaxes(-1, -2))) / p_ - g_wtx[..., np.newaxis] * Wa)
+
+        del gwtx, g_wtx
+        lim = np.abs(np.abs(np.diagonal(np.matmul(W1, np.conj(Wa.swapaxes(-1, -2))),
+                                        axis1=-2, axis2=-1)) - 1).max(axis=-1)
+        W[active] = W1
+        n_iter[active] = ii + 1
+        active = active[lim >= tol]
+        if active.size == 0:
+            break
+    else:
+        warnings.warn('FastICA did not converge for %d of %d problems. Consider increasing tolerance or the maximum number of iterations.'
+                      % (active.size, n_problems))
+
+    return W, n_iter
+
 def _gs_decorrelation(w, W, j):
     """
     Orthonormalize w wrt the first j rows of W.
@@ -120,18 +172,47 @@ def _cube(x, fun_args):     ### NOT FIXED FOR COMPLEX
 """
 
 # Some standard non-linear functions.
-# XXX: these should be optimized, as they can be a bottleneck.
-def _logcosh(x, fun_args=None):
-    alpha = fun_args.get('alpha', 1.0)  # comment it out?
+def _logcosh(x, fun_args=None, out=None):
+    """g(x) = tanh(alpha x) and the row means of g'(x), g'(x)=1-tanh^2(x),
+    computed in one vectorized pass. x is scaled by alpha in place.
+    out : optional tuple (gx, g_x) of preallocated buffers of shapes
+    x.shape and (x.shape[0],), filled and returned instead of new arrays.
+    """
+    fun_args = {} if fun_args is None else fun_args
+    alpha = fun_args.get('alpha', 1.0)
+    if out is None:
+        gx, g_x = np.empty_like(x), np.empty(x.shape[0])
+    else:
+        gx, g_x = out
 
+    p = x.shape[-1]
     x *= alpha
-    gx = np.tanh(x)  # apply the tanh inplace
-    g_x = np.empty(x.shape[0])
-    # XXX compute in chunks to avoid extra allocation
-    for i, gx_i in enumerate(gx):  # please don't vectorize.
-        g_x[i] = (alpha * (1 - gx_i ** 2) * x[i]).mean() + gx_i.mean()   #g'(x)=1-tanh^2(x)
+    np.tanh(x, out=gx)
+    # sum(alpha * (1 - gx ** 2) * x) + sum(gx) per row, without temporaries of the size of x
+    np.subtract(x.sum(axis=-1), np.einsum('ij,ij,ij->i', gx, gx, x), out=g_x)
+    g_x *= alpha
+    g_x += gx.sum(axis=-1)
+    g_x /= p
     return gx, g_x
 
+class _LogCosh(object):
+    """logcosh nonlinearity owning its output buffers.
+    One instance lives for one solver run, so the buffers are allocated once
+    and reused on every iteration (also for fewer rows, e.g. when converged
+    problems are masked out of a batch).
+    """
+    def __init__(self):
+        self._gx = None
+        self._g_x = None
+
+    def __call__(self, x, fun_args=None):
+        rows, cols = x.shape
+        if (self._gx is None or self._gx.shape[0] < rows or
+                self._gx.shape[1] != cols or self._gx.dtype != x.dtype):
+            self._gx = np.empty(x.shape, dtype=x.dtype)
+            self._g_x = np.empty(rows)
+        return _logcosh(x, fun_args, out=(self._gx[:rows], self._g_x[:rows]))
+
 def complexfastica(X, n_components=None, algorithm="parallel", whiten=True,
             fun="logcosh", fun_args=None, max_iter=1000, tol=1e-06, w_init=None,
             random_state=None, return_X_mean=False, compute_sources=True,
@@ -232,7 +313,7 @@ def complexfastica(X, n_components=None, algorithm="parallel", whiten=True,
         raise ValueError('alpha must be in [1,2]')
 
     if fun == 'logcosh':
-        g = _logcosh
+        g = _LogCosh()
     elif fun == 'exp':
         g = _exp
     elif fun == 'cube':
@@ -261,14 +342,13 @@ def complexfastica(X, n_components=None, algorithm="parallel", whiten=True,
     if whiten:
         # Centering the columns (ie the variables)
         X_mean = X.mean(axis=-1)
-        X -= X_mean[:, np.newaxis]
-
-        # Whitening and preprocessing by PCA
-        u, d, _ = np.linalg.svd(X, full_matrices=False)
+        X = X - X_mean[:, np.newaxis]
 
+        # Whitening and preprocessing by PCA, from the eigendecomposition
+        # of the n x n covariance instead of an SVD of the data
+        K, _, _ = whitening_matrix(X, n_components)
         del _
-        K = np.conj((u / d)).T[:n_components]  # see (6.33) p.140
-        del u, d
+        K /= np.sqrt(p)  # see (6.33) p.140, i.e. (u / d).H of the SVD X = u d v.H
         X1 = np.dot(K, X)
         # see (13.6) p.267 Here X1 is white and data
         # in X has been projected onto a subspace by PCA
@@ -338,6 +418,108 @@ def complexfastica(X, n_components=None, algorithm="parallel", whiten=True,
                 return None, W, S
 
 
+def complexfastica_batch(X, n_components=None, fun="logcosh", fun_args=None,
+            max_iter=1000, tol=1e-06, w_init=None, random_state=None,
+            return_n_iter=False):
+    """Perform parallel Fast ICA on a stack of independent problems at once.
+    Equivalent to calling complexfastica(X[f], whiten=True) for every f, but
+    whitening, the fixed-point update, the symmetric decorrelation and the
+    convergence check run as stacked array operations over all problems.
+    Problems that converge early are masked out of the remaining iterations.
+    Parameters
+    ----------
+    X : array-like, shape (n_problems, n_samples, n_features)
+        Stack of training vectors, e.g. one (n_frames, n_channels) matrix
+        per frequency bin.
+    n_components : int, optional
+        Number of components to extract. If None no dimension reduction
+        is performed.
+    fun : string or function, optional. Default: 'logcosh'
+        See complexfastica.
+    fun_args : dictionary, optional
+        See complexfastica.
+    max_iter : int, optional
+        Maximum number of iterations to perform.
+    tol: float, optional
+        Tolerance at which the un-mixing matrix of a problem is considered
+        to have converged.
+    w_init : (n_problems, n_components, n_components) array, optional
+        Initial un-mixing arrays. If None (default) normal r.v.'s are used.
+    random_state : int or RandomState
+        Pseudo number generator state used for random sampling.
+    return_n_iter : bool, optional
+        Whether or not to return the number of iterations of every problem.
+    Returns
+    -------
+    K : array, shape (n_problems, n_components, n_features)
+        Pre-whitening matrices.
+    W : array, shape (n_problems, n_components, n_components)
+        Estimated un-mixing matrices.
+    S : array, shape (n_problems, n_samples, n_components)
+        Estimated source matrices.
+    n_iter : array, shape (n_problems, )
+        Number of iterations taken by every problem. Returned only if
+        return_n_iter is True.
+    """
+    random_state = check_random_state(random_state)
+    fun_args = {} if fun_args is None else fun_args
+    X = np.asarray(X).swapaxes(-1, -2)
+
+    alpha = fun_args.get('alpha', 1.0)
+    if not 1 <= alpha <= 2:
+        raise ValueError('alpha must be in [1,2]')
+
+    if fun == 'logcosh':
+        g = _LogCosh()
+    elif callable(fun):
+        def g(x, fun_args):
+            return fun(x, **fun_args)
+    else:
+        exc = ValueError if isinstance(fun, six.string_types) else TypeError
+        raise exc("Unknown function %r;"
+                  " should be 'logcosh' or callable"
+                  % fun)
+
+    n_problems, n, p = X.shape
+
+    if n_components is None:
+        n_components = min(n, p)
+    if (n_components > min(n, p)):
+        n_components = min(n, p)
+        warnings.warn('n_components is too large: it will be set to %s' % n_components)
+
+    # Centering the rows of every problem
+    X = X - X.mean(axis=-1, keepdims=True)
+
+    # Whitening and preprocessing by PCA, one covariance eigendecomposition
+    # per problem in a single call
+    K, _, _ = whitening_matrix(X, n_components)
+    del _
+    K /= np.sqrt(p)
+    X1 = np.matmul(K, X)
+    X1 *= np.sqrt(p)
+
+    if w_init is None:
+        w_init = np.asarray(random_state.normal(size=(n_problems, n_components,
+                            n_components)), dtype=X1.dtype)
+    else:
+        w_init = np.asarray(w_init)
+        if w_init.shape != (n_problems, n_components, n_components):
+            raise ValueError('w_init has invalid shape -- should be %(shape)s'
+                             % {'shape': (n_problems, n_components, n_components)})
+
+    W, n_iter = _ica_par_batch(X1, tol=tol, g=g, fun_args=fun_args,
+                               max_iter=max_iter, w_init=w_init)
+    del X1
+
+    S = np.matmul(np.matmul(W, K), X).swapaxes(-1, -2)
+
+    if return_n_iter:
+        return K, W, S, n_iter
+    else:
+        return K, W, S
+
+
 class ComplexFastICA(BaseEstimator, TransformerMixin):
     """FastICA: a fast algorithm for Independent Component Analysis.
     Read more in the :ref:`User Guide <ICA>`.
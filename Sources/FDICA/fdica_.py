@@ -4,14 +4,16 @@
 #    Frequency Domain ICA
 #
 # ==================================
-from complex_fastica_ import ComplexFastICA, complexfastica
+from complex_fastica_ import complexfastica_batch
 from stft_ import stft, istft
+from parallel_ import map_shards
 import numpy as np
 import scipy as sp
+from scipy.optimize import linear_sum_assignment
 import sys
 
 
-def _multiple_stft(X, frame_length, win=None, step=None):
+def _multiple_stft(X, frame_length, win=None, step=None, onesided=False):
 
     """
         STFT of multiple data series.
@@ -29,13 +31,14 @@ def _multiple_stft(X, frame_length, win=None, step=None):
         
     step : step size. stpe = frame_length/4 is default.(step=None)
     
+    onesided : if True, X is assumed real and only the frame_length//2+1 non-redundant frequencies are computed (rfft).
     
     S : ndarray of shape (n_samples, n_frames, n_frequencies)
-        output spectogram (3D) matrix, where n_samples is the number of samples, n_frames is the number of frames, and n_frequencies is the number of discrete frequencies (,which equals the length of one frame).
+        output spectogram (3D) matrix, where n_samples is the number of samples, n_frames is the number of frames, and n_frequencies is the number of discrete frequencies (,which equals the length of one frame, or frame_length//2+1 if onesided).
     """
     n_samples = X.shape[0]
     n_features = X.shape[1]
-    n_frequencies = frame_length
+    n_frequencies = frame_length // 2 + 1 if onesided else frame_length
     
     if step is None:
         step = frame_length / 4
@@ -50,20 +53,68 @@ def _multiple_stft(X, frame_length, win=None, step=None):
 
     S=np.zeros([n_samples, n_frames, n_frequencies], dtype=np.complex64)
     for i in range(n_samples):
-        S[i] = stft(X[i], frame_length, win, step)
+        S[i] = stft(X[i], frame_length, win, step, onesided)
 
     return S
 
-def _ica_by_freq(S):
+def _ica_stack(M):
+    """
+        solve a stack of per-frequency mixtures M of shape (n_bins, n_frames, n_samples),
+        returning the separated spectra (n_bins, n_samples, n_frames) and the demixing matrices (n_bins, n_samples, n_samples).
+    """
+    K, W, N = complexfastica_batch(M, n_components=M.shape[2], max_iter=200, tol=1e-4)
+    return N.swapaxes(1, 2), np.matmul(W, K)
+
+def _get_band_bins(frame_length, fs, band, onesided=False):
+    """
+        select the frequency bins inside a passband, e.g. the physiological band of the band-passed PPG.
+        
+    parameters
+    ----------
+    frame_length : a length of one frame.
+    
+    fs : sampling frequency.
+    
+    band : (f_low, f_high) in the unit of fs. a bin is selected if f_low <= |f| <= f_high.
+    
+    onesided : see _multiple_stft.
+    
+    bins : ndarray of shape (n_frequencies) and dtype bool
+        True for the frequency bins inside the band.
+    """
+    
+    if onesided:
+        freqs = np.fft.rfftfreq(frame_length, 1. / fs)
+    else:
+        freqs = np.abs(np.fft.fftfreq(frame_length, 1. / fs))
+    bins = (freqs >= band[0]) & (freqs <= band[1])
+    if not bins.any():
+        raise ValueError("no frequency bin lies inside the band [%g, %g], the bin spacing is %g"
+                         % (band[0], band[1], fs / frame_length))
+    
+    return bins
+
+def _ica_by_freq(S, executor=None, n_jobs=None, bins=None, out_of_band='pass'):
     """
         apply ComplexfastICA Fourier-transformed data by frequency,
         and get separated spectra.
+        all frequency bins are solved together by complexfastica_batch.
         
     parameters
     ----------
     S : ndarray of shape (n_samples, n_frames, n_frequencies)
         input spectogram (3D) matrix, where n_samples is the number of samples, n_frames is the number of frames, and n_frequencies is the number of discrete frequencies (,which equals the length of one frame).
         
+    executor : None (default) solves all bins in this process.
+        'process' shards the bins across n_jobs worker processes which read the spectrogram from shared memory.
+        
+    n_jobs : number of worker processes for executor='process'. os.cpu_count() is default.
+    
+    bins : boolean mask or indices of the frequency bins to be separated (see _get_band_bins). all bins are separated by default (bins=None).
+    
+    out_of_band : 'pass' (default) passes the other bins through unchanged (identity demixing),
+        'zero' sets their separated spectra to zero.
+        
     T : ndarray of shape (n_samples, n_frames, n_frequencies)
         output separated spectrogram (3D) matrix, whose size is the same as S.
         this is the result of application of (complex) ICA to S by frequency
@@ -74,20 +125,56 @@ def _ica_by_freq(S):
     """
     
     n_samples, n_frames , n_frequencies= S.shape
-    T = np.zeros(S.shape, dtype=np.complex64)
-    WK = np.zeros([n_samples, n_samples, n_frequencies], dtype=np.complex64)
+    
+    if out_of_band not in ('pass', 'zero'):
+        raise ValueError("out_of_band must be 'pass' or 'zero'")
+    mask = np.ones(n_frequencies, dtype=bool)
+    if bins is not None:
+        mask[:] = False
+        mask[bins] = True
+        if not mask.any():
+            raise ValueError("bins selects no frequency bin")
 
-    for l in range(n_frequencies):
-        M = S[:,:,l].T
-        M = M.astype(np.complex64)
-        M /= M.std(axis = 0)
-        ica = ComplexFastICA(n_components=n_samples)
-        N = ica.fit_transform(M).T
-        T[:,:,l] = N
-        WK[:,:,l] = ica.components_
+    # M[l] is the (n_frames, n_samples) mixture of the l-th selected frequency
+    M = S[:, :, mask].transpose(2, 1, 0).astype(np.complex64)
+    M /= M.std(axis = 1, keepdims = True)
+    if executor is None:
+        T_band, WK_band = _ica_stack(M)
+    elif executor == 'process':
+        T_band, WK_band = map_shards(_ica_stack, M, [((n_samples, n_frames), np.complex64),
+                                                     ((n_samples, n_samples), np.complex64)], n_jobs=n_jobs)
+    else:
+        raise ValueError("executor must be None or 'process'")
+
+    T_band = T_band.transpose(1, 2, 0).astype(np.complex64)
+    WK_band = WK_band.transpose(1, 2, 0).astype(np.complex64)
+    if mask.all():
+        return T_band, WK_band
+
+    if out_of_band == 'pass':
+        T = S.astype(np.complex64)
+    else:
+        T = np.zeros([n_samples, n_frames, n_frequencies], dtype=np.complex64)
+    WK = np.repeat(np.eye(n_samples, dtype=np.complex64)[:, :, np.newaxis], n_frequencies, axis=2)
+    T[:, :, mask] = T_band
+    WK[:, :, mask] = WK_band
 
     return T, WK
 
+def _get_inverse_demixing(WK):
+    """
+        invert the demixing matrices of all frequencies in one batched call.
+        
+    parameters
+    ----------
+    WK : ndarray of shape (n_samples, n_samples, n_frequencies)
+        input demixing matrix.
+        
+    A : ndarray of shape (n_samples, n_samples, n_frequencies)
+        output projection-back (mixing) matrix, i.e. A[:,:,l] = (WK[:,:,l])^(-1)
+    """
+    return np.linalg.inv(WK.transpose(2, 0, 1)).transpose(1, 2, 0)
+
 def _get_split_spectrum(T,WK):
     """
         get split spectra from separated spectra.
@@ -105,17 +192,12 @@ def _get_split_spectrum(T,WK):
         output split spectrogram matreces, where n_samples is the number of samples, n_frames is the number of frames, and n_frequencies is the number of discrete frequencies (,which equals the length of one frame).
         U[n] denotes the split spectrogram matrix of the n-th separated spectrogram,
             i.e. U[n,:,k,l] = (WK[l])^(-1) [0, ... , T[n,k,l], ..., 0].T
+    
+    fdica itself does not materialize U; see _get_split_power and _get_projected_sources.
     """
 
-    n_samples, n_frames, n_frequencies = T.shape
-    U = np.zeros([n_samples, n_samples, n_frames, n_frequencies], dtype=np.complex64)
-    
-    for l in range(n_frequencies):
-        for n in range(n_samples):
-            _T = np.zeros([n_samples, n_frames], dtype=np.complex64)
-            _T[n,:] = T[n,:,l]
-            inv_WK = np.linalg.inv(WK[:,:,l])
-            U[n,:,:,l] = np.dot(inv_WK, _T)
+    A = _get_inverse_demixing(WK)
+    U = np.einsum('mnl,nkl->nmkl', A, T).astype(np.complex64)
     
     return U
 
@@ -143,8 +225,170 @@ def _get_power_of_spectrum(U):
     
     return P
 
+def _get_split_power(T, A):
+    """
+        get the power of split spectrum sequence directly from the separated spectra,
+        without materializing the split spectra U.
+        
+    parameters
+    ----------
+    T : ndarray of shape (n_samples, n_frames, n_frequencies)
+        input separated spectrogram (3D) matrix.
+        
+    A : ndarray of shape (n_samples, n_samples, n_frequencies)
+        input projection-back matrix, see _get_inverse_demixing.
+    
+    P : ndarray of shape (n_samples, n_samples, n_frequencies)
+        output power matrix, the same as _get_power_of_spectrum(_get_split_spectrum(T, WK)),
+        since P[n,m,l] = |A[m,n,l]|^2 * mean_k |T[n,k,l]|^2.
+    """
+    
+    return np.einsum('mnl,nl->nml', np.abs(A)**2, np.mean(np.abs(T)**2, axis=1))
+
+def _get_projected_sources(T, A, src):
+    """
+        project the assigned separated spectra back onto the observations.
+        
+    parameters
+    ----------
+    T : ndarray of shape (n_samples, n_frames, n_frequencies)
+        input separated spectrogram (3D) matrix.
+        
+    A : ndarray of shape (n_samples, n_samples, n_frequencies)
+        input projection-back matrix, see _get_inverse_demixing.
+        
+    src : ndarray of shape (n_samples, n_frequencies)
+        index of the separated spectrum assigned to the output m at frequency l.
+    
+    V : ndarray of shape (n_samples, n_frames, n_frequencies)
+        output spectrogram, V[m,:,l] = U[src[m,l],m,:,l] = A[m,src[m,l],l] * T[src[m,l],:,l]
+    """
+    
+    n_samples, n_frames, n_frequencies = T.shape
+    m = np.arange(n_samples)[:, np.newaxis]
+    l = np.arange(n_frequencies)[np.newaxis, :]
+    
+    V = A[m, src, l][:, np.newaxis, :] * T[src, :, l].swapaxes(1, 2)
+    
+    return V.astype(np.complex64)
+
+def _get_dual_permutation(P):
+    """
+        decide the order of two split spectra by their powers, for all frequencies at once.
+        
+    parameters
+    ----------
+    P : ndarray of shape (2, 2, n_frequencies)
+        input power matrix, see _get_power_of_spectrum.
+    
+    src : ndarray of shape (2, n_frequencies)
+        index of the split spectrum assigned to the output m at frequency l.
+    """
+    
+    P_plus1 = P[0,0] + P[0,1]
+    P_plus2 = P[1,0] + P[1,1]
+    P_minus1 = P[0,0] - P[0,1]
+    P_minus2 = P[1,0] - P[1,1]
+    
+    keep = np.where(P_plus1 > P_plus2, P_minus1 > 0, P_minus2 < 0)
+    src = np.where(keep, [[0], [1]], [[1], [0]])
+    
+    return src
+
+def _assign_max(C):
+    """
+        one-to-one assignment of sources to outputs with the largest summed score, for all frequencies.
+        two sources compare both orders at once, more sources use a linear sum assignment per frequency.
+        
+    parameters
+    ----------
+    C : ndarray of shape (n_frequencies, n_samples, n_samples)
+        C[l,n,m] is the score of assigning the source n to the output m at frequency l.
+    
+    src : ndarray of shape (n_samples, n_frequencies)
+        index of the source assigned to the output m at frequency l.
+    """
+    
+    n_frequencies, n_samples, _ = C.shape
+    del _
+    
+    if n_samples == 2:
+        keep = C[:, 0, 0] + C[:, 1, 1] >= C[:, 0, 1] + C[:, 1, 0]
+        return np.where(keep, [[0], [1]], [[1], [0]])
+    
+    src = np.zeros([n_samples, n_frequencies], dtype=int)
+    for l in range(n_frequencies):
+        sources, outputs = linear_sum_assignment(-C[l])
+        src[outputs, l] = sources
+    
+    return src
+
+def _get_permutation(P):
+    """
+        decide the order of n split spectra by their powers.
+        two sources use the closed-form rule of _get_dual_permutation.
+        for more sources every source n is assigned to one output m so that the summed power share
+        Q[n,m,l] = P[n,m,l] / sum_m P[n,m,l] is maximal (linear sum assignment per frequency).
+        
+    parameters
+    ----------
+    P : ndarray of shape (n_samples, n_samples, n_frequencies)
+        input power matrix, see _get_power_of_spectrum.
+    
+    src : ndarray of shape (n_samples, n_frequencies)
+        index of the split spectrum assigned to the output m at frequency l.
+    """
+    
+    if P.shape[0] == 2:
+        return _get_dual_permutation(P)
+    
+    # scores of all frequencies computed at once; only the n x n assignments run per frequency
+    Q = (P / np.maximum(P.sum(axis=1, keepdims=True), np.finfo(np.float64).tiny)).real
+    
+    return _assign_max(Q.transpose(2, 0, 1))
 
-def _correct_dual_permutation(U, transfer=True):
+def _get_envelope_permutation(T, max_iter=20):
+    """
+        decide the order of n separated spectra by clustering their amplitude envelopes.
+        the envelopes |T[n,:,l]| of one source are correlated across frequencies, so every frequency is
+        assigned to running centroids (seeded by the frequency with the most power) by the largest summed
+        correlation, and the centroids are updated with the aligned envelopes until no assignment changes.
+        
+    parameters
+    ----------
+    T : ndarray of shape (n_samples, n_frames, n_frequencies)
+        input separated spectrogram (3D) matrix.
+    
+    max_iter : maximum number of assignment / centroid updates.
+    
+    src : ndarray of shape (n_samples, n_frequencies)
+        index of the separated spectrum assigned to the output m at frequency l.
+    """
+    
+    n_samples, n_frames, n_frequencies = T.shape
+    l = np.arange(n_frequencies)[np.newaxis, :]
+    
+    # centered envelopes of unit norm, so that correlations are inner products
+    Z = np.abs(T).transpose(2, 0, 1).astype(np.float64)
+    Z -= Z.mean(axis=2, keepdims=True)
+    Z /= np.maximum(np.linalg.norm(Z, axis=2, keepdims=True), np.finfo(np.float64).tiny)
+    
+    centroids = Z[np.argmax(np.sum(np.abs(T)**2, axis=(0, 1)))]
+    src = None
+    
+    for n_iter in range(max_iter):
+        # correlations of all envelopes with all centroids, C[l,n,m]
+        new_src = _assign_max(np.einsum('lnk,mk->lnm', Z, centroids))
+        if src is not None and (new_src == src).all():
+            break
+        src = new_src
+        
+        centroids = Z[l, src].mean(axis=1)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), np.finfo(np.float64).tiny)
+    
+    return src
+
+def _correct_permutation(U, transfer=True):
     """
         correct permutation of split spectra.
         
@@ -162,44 +406,67 @@ def _correct_dual_permutation(U, transfer=True):
     _, n_samples, n_frames, n_frequencies = U.shape
     del _
     
-    if n_samples != 2:
-        print ("the number of samples should exactly be 2.\n")
-        sys.exit()
-    
     V = np.zeros([n_samples, n_frames, n_frequencies], dtype=np.complex64)
+    if not transfer:
+        return V
 
-    P = _get_power_of_spectrum(U)
-    
-    for l in range(n_frequencies):
-        P_plus1 = P[0,0,l] + P[0,1,l]
-        P_plus2 = P[1,0,l] + P[1,1,l]
-        P_minus1 = P[0,0,l] - P[0,1,l]
-        P_minus2 = P[1,0,l] - P[1,1,l]
-
-        if P_plus1 > P_plus2:
-            if transfer:
-                if P_minus1 > 0:
-                    V[0,:,l] = U[0,0,:,l]
-                    V[1,:,l] = U[1,1,:,l]
-                else:
-                    V[0,:,l] = U[1,0,:,l]
-                    V[1,:,l] = U[0,1,:,l]
-        else:
-            if transfer:
-                if P_minus2 < 0:
-                    V[0,:,l] = U[0,0,:,l]
-                    V[1,:,l] = U[1,1,:,l]
-                else:
-                    V[0,:,l] = U[1,0,:,l]
-                    V[1,:,l] = U[0,1,:,l]
+    src = _get_permutation(_get_power_of_spectrum(U))
+    m = np.arange(n_samples)[:, np.newaxis]
+    l = np.arange(n_frequencies)[np.newaxis, :]
+    V[...] = U[src, m, :, l].swapaxes(1, 2)
 
+    return V
 
+# formerly restricted to exactly two sources
+_correct_dual_permutation = _correct_permutation
 
 
-    return V
+def _correct_split_permutation(T, WK, transfer=True, method='power', bins=None):
+    """
+        fused projection-back and permutation correction.
+        gives the same V as _correct_permutation(_get_split_spectrum(T, WK)),
+        but the split spectra U (n_samples * n_samples * n_frames * n_frequencies) are never materialized.
+        
+    parameters
+    ----------
+    T : ndarray of shape (n_samples, n_frames, n_frequencies)
+        input separated spectrogram (3D) matrix.
+        
+    WK : ndarray of shape (n_samples, n_samples, n_frequencies)
+        input demixing matrix.
+        
+    method : 'power' (default) aligns the split spectra by their powers (see _get_permutation),
+        'envelope' by the correlation of their amplitude envelopes (see _get_envelope_permutation).
+        
+    bins : boolean mask or indices of the separated frequency bins (see _ica_by_freq), only these are permuted.
+        all bins are permuted by default (bins=None).
+        
+    V : ndarray of shape (n_samples, n_frames, n_frequencies)
+        output permutation-corrected split spectrogram matrix.
+    """
+    n_samples, n_frames, n_frequencies = T.shape
+    
+    if not transfer:
+        return np.zeros([n_samples, n_frames, n_frequencies], dtype=np.complex64)
+    
+    mask = np.ones(n_frequencies, dtype=bool)
+    if bins is not None:
+        mask[:] = False
+        mask[bins] = True
+    
+    A = _get_inverse_demixing(WK)
+    src = np.repeat(np.arange(n_samples)[:, np.newaxis], n_frequencies, axis=1)
+    if method == 'power':
+        src[:, mask] = _get_permutation(_get_split_power(T[:, :, mask], A[:, :, mask]))
+    elif method == 'envelope':
+        src[:, mask] = _get_envelope_permutation(T[:, :, mask])
+    else:
+        raise ValueError("method must be 'power' or 'envelope'")
+    
+    return _get_projected_sources(T, A, src)
 
 
-def _multiple_istft(U, frame_length, win=None, step=None):
+def _multiple_istft(U, frame_length, win=None, step=None, onesided=False):
 
     """
     U : ndarray of shape (n_samples, n_frames, n_frequencies)
@@ -213,6 +480,8 @@ def _multiple_istft(U, frame_length, win=None, step=None):
     
     step : step size. stpe = frame_length/4 is default.(step=None)
     
+    onesided : if True, U holds only the frame_length//2+1 non-redundant frequencies of real signals (irfft).
+    
     Y : ndarray of shape (n_samples, n_features)
         output multiple data series, where n_samples is the number of samples and n_features is the number of features.
     """
@@ -228,23 +497,63 @@ def _multiple_istft(U, frame_length, win=None, step=None):
         print ("step is invalid.\n")
         sys.exit()
     
-    datalength = (n_frames - 1) * step + n_frequencies
+    datalength = (n_frames - 1) * int(step) + frame_length
     Y=np.zeros([n_samples, datalength])
     for i in range(n_samples):
-        Y[i] = istft(U[i], frame_length, win, step)
+        Y[i] = istft(U[i], frame_length, win, step, onesided)
 
     return Y
 
-def fdica(X, frame_length, win=None, step=None):
+def fdica(X, frame_length, win=None, step=None, onesided=False, executor=None, n_jobs=None, permutation='power',
+          fs=None, band=None, out_of_band='pass', return_bins=False):
+    """
+        Frequency domain ICA of multiple data series.
+        
+    parameters
+    ----------
+    X : ndarray of shape (n_samples, n_features)
+        input multiple data series.
+    
+    frame_length, win, step : see _multiple_stft.
+    
+    onesided : if True, X is treated as real (e.g. PPG data) and ICA is solved only on the frame_length//2+1 non-redundant frequencies.
+        the negative frequencies are the complex conjugates of these and are restored by the inverse rfft.
+    
+    executor, n_jobs : see _ica_by_freq. executor='process' runs the per-bin ICA on all cores.
+    
+    permutation : 'power' (default) or 'envelope', the permutation alignment, see _correct_split_permutation.
+        'envelope' clusters the amplitude envelopes and suits more than two sources.
+    
+    fs, band : sampling frequency and passband (f_low, f_high), e.g. the band of a preceding band-pass filter.
+        if band is given, ICA is solved only on the frequency bins inside the band (see _get_band_bins).
+        all bins are separated by default (band=None).
+    
+    out_of_band : 'pass' (default) or 'zero', the treatment of the bins outside the band, see _ica_by_freq.
+    
+    return_bins : if True, the indices of the separated frequency bins are returned as well.
+    
+    Y : ndarray of shape (n_samples, n_features)
+        output separated data series.
+    
+    bins : ndarray, indices of the separated frequency bins (only if return_bins is True).
+    """
 
-    S = _multiple_stft(X, frame_length, win, step)
-    T, WK = _ica_by_freq(S)
+    if band is None:
+        bins = None
+    elif fs is None:
+        raise ValueError("the sampling frequency fs is needed for a band")
+    else:
+        bins = _get_band_bins(frame_length, fs, band, onesided)
+
+    S = _multiple_stft(X, frame_length, win, step, onesided)
+    T, WK = _ica_by_freq(S, executor, n_jobs, bins, out_of_band)
     
     del S
-    U = _get_split_spectrum(T, WK)
+    V = _correct_split_permutation(T, WK, method=permutation, bins=bins)
     del T, WK
-    V = _correct_dual_permutation(U)
-    del U
-    Y = _multiple_istft(V, frame_length, win, step)
+    Y = _multiple_istft(V, frame_length, win, step, onesided)
+
+    if return_bins:
+        return Y, np.arange(V.shape[2]) if bins is None else np.flatnonzero(bins)
 
     return Y
\ No newline at end of file
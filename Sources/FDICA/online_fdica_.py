@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# ==================================
+#
+#    Online Frequency Domain ICA
+#
+# ==================================
+from scipy.signal.windows import hamming, hanning
+from scipy.fftpack import fft, ifft
+from fdica_ import _assign_max, _get_projected_sources
+import numpy as np
+import sys
+
+__all__ = ['OnlineFDICA']
+
+
+class OnlineFDICA(object):
+    """
+        streaming frequency domain ICA.
+        samples are pushed as they arrive, every complete STFT frame updates the per-frequency
+        demixing matrices by one natural-gradient step, and the separated frame is permutation-corrected,
+        projected back and overlap-added. Separated samples can be pulled with a latency of
+        frame_length - step samples, flush returns the rest at the end of a stream.
+        the permutation of every frequency is aligned to the output order of the previous frames:
+        the recent amplitude envelopes of its sources are correlated with the envelopes of the outputs,
+        and the chosen order is kept in the rows of W, so the next frame starts from it.
+
+    parameters
+    ----------
+    n_channels : number of observed data series (= number of separated sources).
+
+    frame_length : a length of one frame.
+
+    win : window function. hamming window is default (win=None) and another option is now hannig window only.
+
+    step : step size. stpe = frame_length/4 is default.(step=None)
+
+    onesided : if True (default), the data are real and only the frame_length//2+1 non-redundant frequencies are separated.
+
+    mu : step size of the natural-gradient update W <- W + mu (I - phi(y) y^H) W, where phi(y) = y/|y|.
+
+    forget : forgetting factor of the running powers used for input normalization.
+
+    history : number of recent frames whose amplitude envelopes align the permutations.
+        the order of the sources is kept as initialized until history frames have been processed.
+
+    attributes
+    ----------
+    W : ndarray of shape (n_frequencies, n_channels, n_channels)
+        current demixing matrices of the power-normalized observations, the rows in output order.
+
+    n_frames : number of frames processed so far.
+    """
+    def __init__(self, n_channels, frame_length, win=None, step=None, onesided=True, mu=0.05, forget=0.95,
+                 history=64):
+        if win is None:
+            win = hamming(frame_length)
+        elif win == 'hanning':
+            win = hanning(frame_length)
+        else:
+            print ("Window name is invalid.\n")
+            sys.exit()
+
+        if step is None:
+            step = frame_length / 4
+        elif step > frame_length:
+            print ("step is longer than frame_length.\n")
+            sys.exit()
+        elif step <= 0:
+            print ("step is invalid.\n")
+            sys.exit()
+
+        self.n_channels = n_channels
+        self.frame_length = frame_length
+        self.win = win
+        self.step = int(step)
+        self.onesided = onesided
+        self.mu = mu
+        self.forget = forget
+        self.history = history
+        self.n_frequencies = frame_length // 2 + 1 if onesided else frame_length
+
+        self.W = np.tile(np.eye(n_channels, dtype=np.complex128), (self.n_frequencies, 1, 1))
+        self.n_frames = 0
+
+        self._power = None
+        self._envelopes = np.zeros([n_channels, history, self.n_frequencies])
+        self._reset_stream()
+
+    def _reset_stream(self):
+        self._in = np.zeros([self.n_channels, 0])
+        self._out = np.zeros([self.n_channels, self.frame_length])
+        self._wsum = np.zeros(self.frame_length)
+        self._ready = []
+        # samples pushed and pulled, and frames processed since the start of the stream
+        self._n_in = 0
+        self._n_out = 0
+        self._n_stream_frames = 0
+
+    def push(self, samples):
+        """
+            append new samples and process every frame that is complete.
+
+        parameters
+        ----------
+        samples : ndarray of shape (n_channels, n_new_samples)
+        """
+        samples = np.asarray(samples, dtype=np.float64).reshape(self.n_channels, -1)
+        self._in = np.concatenate([self._in, samples], axis=1)
+        self._n_in += samples.shape[1]
+
+        while self._in.shape[1] >= self.frame_length:
+            self._process_frame(self._in[:, :self.frame_length])
+            self._in = self._in[:, self.step:]
+
+    def pull(self):
+        """
+            take the separated samples that are complete so far.
+
+        Y : ndarray of shape (n_channels, n_ready_samples)
+        """
+        if not self._ready:
+            return np.zeros([self.n_channels, 0])
+        Y = np.concatenate(self._ready, axis=1)
+        self._ready = []
+        self._n_out += Y.shape[1]
+        return Y
+
+    def flush(self):
+        """
+            finish the stream and take all separated samples that are left.
+            the remaining samples are zero padded to complete frames, which are only demixed
+            (no update of W and of the running powers), and the overlap-add tail is emitted.
+            the demixing state is kept, so a new stream can be pushed afterwards.
+
+        Y : ndarray of shape (n_channels, n_remaining_samples)
+            together with the earlier pulls exactly as many samples as were pushed.
+        """
+        N, step = self.frame_length, self.step
+
+        # frames until every pushed sample lies in at least one frame
+        n_frames = -(-max(self._n_in - N, 0) // step) + 1 if self._n_in else 0
+        for _ in range(n_frames - self._n_stream_frames):
+            frame = np.zeros([self.n_channels, N])
+            frame[:, :self._in.shape[1]] = self._in[:, :N]
+            self._process_frame(frame, adapt=False)
+            self._in = self._in[:, step:]
+
+        # no frame will overlap the tail any more
+        tail = self._out[:, :N - step].copy()
+        pos = (self._wsum[:N - step] != 0)
+        tail[:, pos] /= self._wsum[:N - step][pos]
+        self._ready.append(tail)
+
+        Y = np.concatenate(self._ready, axis=1)[:, :self._n_in - self._n_out]
+        self._reset_stream()
+        return Y
+
+    def _align(self):
+        """
+            order the sources of every frequency like the outputs of the previous frames.
+            the centered envelopes of the last history frames are correlated with the mean envelope of every
+            output over all frequencies, whose rows are in the order carried over from the previous frame.
+
+        src : ndarray of shape (n_channels, n_frequencies)
+            index of the source assigned to the output m at frequency l.
+        """
+        Z = self._envelopes - self._envelopes.mean(axis=1, keepdims=True)
+        Z /= np.maximum(np.linalg.norm(Z, axis=1, keepdims=True), np.finfo(np.float64).tiny)
+        reference = Z.mean(axis=2)
+        reference /= np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), np.finfo(np.float64).tiny)
+
+        return _assign_max(np.einsum('nkl,mk->lnm', Z, reference))
+
+    def _process_frame(self, frame, adapt=True):
+        N, step, forget = self.frame_length, self.step, self.forget
+
+        if self.onesided:
+            X = np.fft.rfft(frame * self.win, axis=1)
+        else:
+            X = fft(frame * self.win, axis=1)
+
+        # running power per channel and frequency normalizes the observations
+        if self._power is None:
+            self._power = np.abs(X)**2 + np.finfo(np.float64).eps
+        elif adapt:
+            self._power = forget * self._power + (1 - forget) * np.abs(X)**2
+        Xn = X / np.sqrt(self._power)
+
+        if adapt:
+            # one natural-gradient step for all frequencies at once
+            Y = np.einsum('lmn,nl->ml', self.W, Xn)
+            phi = Y / np.maximum(np.abs(Y), np.finfo(np.float64).eps)
+            G = np.eye(self.n_channels) - np.einsum('ml,kl->lmk', phi, Y.conj())
+            self.W += self.mu * np.matmul(G, self.W)
+        Y = np.einsum('lmn,nl->ml', self.W, Xn)
+
+        if adapt:
+            # permutation correction against the previous frames; the update is equivariant to
+            # row permutations, so reordering W carries the output order to the next frame
+            self._envelopes = np.roll(self._envelopes, -1, axis=1)
+            self._envelopes[:, -1] = np.abs(Y)
+            if self.n_frames + 1 >= self.history:
+                src = self._align()
+                l = np.arange(self.n_frequencies)
+                self.W = self.W[l, src].swapaxes(0, 1)
+                self._envelopes = self._envelopes[src, :, l].transpose(0, 2, 1)
+                Y = Y[src, l]
+
+        # projection back onto the (unnormalized) observations
+        A = np.sqrt(self._power).T[:, :, np.newaxis] * np.linalg.inv(self.W)
+        A = A.transpose(1, 2, 0)
+        identity = np.repeat(np.arange(self.n_channels)[:, np.newaxis], self.n_frequencies, axis=1)
+        V = _get_projected_sources(Y[:, np.newaxis, :], A, identity)[:, 0, :]
+
+        if self.onesided:
+            y = np.fft.irfft(V, n=N, axis=1)
+        else:
+            y = ifft(V, axis=1).real
+
+        # overlap-add; the first step samples are not touched by later frames any more
+        self._out += y * self.win
+        self._wsum += self.win ** 2
+        done = self._out[:, :step].copy()
+        pos = (self._wsum[:step] != 0)
+        done[:, pos] /= self._wsum[:step][pos]
+        self._ready.append(done)
+
+        self._out = np.concatenate([self._out[:, step:], np.zeros([self.n_channels, step])], axis=1)
+        self._wsum = np.concatenate([self._wsum[step:], np.zeros(step)])
+        self._n_stream_frames += 1
+        if adapt:
+            self.n_frames += 1
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# ==================================
+#
+#    Process-pool sharding of independent ICA problems
+#
+# ==================================
+from multiprocessing import get_all_start_methods, get_context
+from multiprocessing.shared_memory import SharedMemory
+from contextlib import contextmanager
+import os
+import numpy as np
+# shipped with scikit-learn, which complex_fastica_ requires anyway
+from threadpoolctl import threadpool_limits
+
+__all__ = ['map_shards']
+
+
+"""
+The input stack is copied once into a shared-memory block. Workers attach to it by name and
+write their results into shared output blocks, so neither the spectrogram nor the results are pickled.
+Only the solver function and the block descriptors (name, shape, dtype) travel to the workers.
+Every shard seeds the global numpy RNG from its own child of one SeedSequence, so forked workers
+do not repeat the random initializations of each other.
+"""
+
+_BLAS_ENV = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+             'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+@contextmanager
+def _blas_env(n_threads):
+    """set the BLAS thread variables while workers are started, so freshly spawned workers inherit them"""
+    saved = {key: os.environ.get(key) for key in _BLAS_ENV}
+    for key in _BLAS_ENV:
+        os.environ[key] = str(n_threads)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+_limits = None
+
+
+def _init_worker(n_threads):
+    # forked workers have BLAS loaded already, the environment variables only reach spawned ones
+    global _limits
+    _limits = threadpool_limits(n_threads)
+
+
+def _create(shape, dtype):
+    dtype = np.dtype(dtype)
+    shm = SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _attach(desc):
+    name, shape, dtype = desc
+    shm = SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _run_shard(func, in_desc, out_descs, lo, hi, seed):
+    np.random.seed(seed.generate_state(4))
+    shm_in, X = _attach(in_desc)
+    outs = [_attach(desc) for desc in out_descs]
+    shms = [shm_in] + [shm for shm, _ in outs]
+    try:
+        X.flags.writeable = False
+        results = func(X[lo:hi])
+        for k in range(len(outs)):
+            outs[k][1][lo:hi] = results[k]
+    finally:
+        # views on the blocks must be released before they can be closed
+        del X, outs
+        for shm in shms:
+            shm.close()
+
+
+def map_shards(func, X, out_specs, n_jobs=None, blas_threads=1, seed=None):
+    """
+        apply func to shards of a stack of independent problems in worker processes.
+
+    parameters
+    ----------
+    func : picklable (module level) function
+        maps X[lo:hi] to a tuple of arrays whose leading dimension is hi - lo.
+
+    X : ndarray of shape (n_items, ...)
+        stack of problems, e.g. one (n_frames, n_samples) mixture per frequency bin.
+
+    out_specs : list of (shape, dtype)
+        the trailing shape and dtype of every array returned by func.
+
+    n_jobs : number of worker processes. os.cpu_count() is default.
+
+    blas_threads : number of BLAS threads per worker, 1 is default to avoid oversubscription.
+
+    seed : None, int or SeedSequence
+        entropy of the shard seeds, fresh entropy is drawn by default.
+
+    outs : list of ndarray of shape (n_items, *shape)
+        the results of func, gathered over all shards.
+    """
+    n_items = X.shape[0]
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    # a few shards per worker balance problems that converge at different speeds
+    bounds = np.linspace(0, n_items, min(n_items, 4 * n_jobs) + 1).astype(int)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(len(bounds) - 1)
+
+    shm_in, X_shared = _create(X.shape, X.dtype)
+    outs = [_create((n_items,) + tuple(shape), dtype) for shape, dtype in out_specs]
+    try:
+        X_shared[...] = X
+        in_desc = (shm_in.name, X.shape, X_shared.dtype.str)
+        out_descs = [(shm.name, arr.shape, arr.dtype.str) for shm, arr in outs]
+
+        # fork keeps the caller's __main__ out of the workers' import path
+        method = 'fork' if 'fork' in get_all_start_methods() else 'spawn'
+        with _blas_env(blas_threads):
+            pool = get_context(method).Pool(n_jobs, initializer=_init_worker, initargs=(blas_threads,))
+        with pool:
+            pending = [pool.apply_async(_run_shard, (func, in_desc, out_descs, lo, hi, shard_seed))
+                       for lo, hi, shard_seed in zip(bounds[:-1], bounds[1:], seeds) if hi > lo]
+            for job in pending:
+                job.get()
+
+        results = [arr.copy() for _, arr in outs]
+    finally:
+        shms = [shm_in] + [shm for shm, _ in outs]
+        del X_shared, outs
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    return results
@@ -6,9 +6,11 @@
 # ==================================
 from scipy.signal.windows import hamming, hanning
 from scipy.fftpack import fft, ifft
+from numpy.lib.stride_tricks import as_strided
 from scipy.io.wavfile import read
 import pylab as pl
 import sys
+from functools import lru_cache
 import numpy as np
 
 __all__ = ['stft', 'istft']
@@ -26,45 +28,76 @@ step : step size.
 X : ndarray of shape (K, L)
     output spectrogram matrix, where K is the number of frames and L is the number of discrete frequencies (which equals to the length of one frame).
     i.e. X[k,l] is the spectrogram of frame k and frequency l. 
+
+onesided : if True, x is treated as a real signal and only the L//2+1 non-redundant frequencies are kept (rfft/irfft).
 """
 
 # ======
 #  STFT
 # ======
 
-def _stft(x, win, step):
+def _frame_matrix(x, N, step, M):
+    """(M, N) read-only strided view of x, i.e. row m is x[step*m : step*m + N]."""
+    stride = x.strides[0]
+    return as_strided(x, shape=(M, N), strides=(step * stride, stride), writeable=False)
+
+def _stft(x, win, step, onesided=False):
     l = len(x) # Input signal length
     N = len(win) # Window width, i.e., the width to be cut out
     M = int(np.ceil(float(l - N + step) / step)) # Number of time frames in the spectrogram
     step = int(step)
-    new_x = np.zeros(N + ((M - 1) * step), dtype= np.float)
+    new_x = np.zeros(N + ((M - 1) * step), dtype= np.float64)
     new_x[: l] = x # Make the signal a good length.
     
-    X = np.zeros([M, N], dtype = np.complex64) # Spectrogram initialization (complex type)
     #Rows correspond to frames, columns to (normalized) frequencies
     #That is, the (k,l) component is the lth frequency component of the kth frame.
-    for m in range(M):
-        start = step * m
-        X[m, :] = fft(new_x[start : start + N] * win)
+    #All frames are windowed in one broadcast and transformed by one batched FFT.
+    frames = _frame_matrix(new_x, N, step, M)
+    if onesided:
+        X = np.fft.rfft(frames * win, axis=1).astype(np.complex64)
+    else:
+        X = fft(frames * win, axis=1).astype(np.complex64)
     return X
 
 # =======
 #  iSTFT
 # =======
-def _istft(X, win, step):
-    M, N = X.shape
-    assert (len(win) == N), "FFT length and window length are different."
-    
+def _overlap_add(frames, step):
+    """Overlap-add the rows of an (M, N) frame matrix with hop size step in one scatter."""
+    M, N = frames.shape
     l = (M - 1) * step + N
-    x = np.zeros(l, dtype = np.float)
-    wsum = np.zeros(l, dtype = np.float)
-    for m in range(M):
-        start = step * m
-        ### Smooth connection
-        x[start : start + N] = x[start : start + N] + ifft(X[m, :]).real * win
-        wsum[start : start + N] += win ** 2
+    idx = step * np.arange(M)[:, np.newaxis] + np.arange(N)
+    return np.bincount(idx.ravel(), weights=frames.ravel(), minlength=l)
+
+@lru_cache(maxsize=32)
+def _cached_wsum(win_bytes, N, step, M):
+    win = np.frombuffer(win_bytes, dtype=np.float64)
+    wsum = _overlap_add(np.tile(win ** 2, (M, 1)), step)
+    wsum.setflags(write=False)
+    return wsum
+
+def _window_power(win, step, M):
+    """Overlap-added squared window of M frames, cached per (window, fftLen, step)."""
+    win = np.ascontiguousarray(win, dtype=np.float64)
+    return _cached_wsum(win.tobytes(), len(win), int(step), M)
+
+def _istft(X, win, step, onesided=False):
+    M, L = X.shape
+    N = len(win)
+    if onesided:
+        assert (L == N // 2 + 1), "FFT length and window length are different."
+    else:
+        assert (L == N), "FFT length and window length are different."
+    step = int(step)
+    
+    ### Smooth connection: one inverse FFT over all frames, then one overlap-add
+    if onesided:
+        frames = np.fft.irfft(X, n=N, axis=1)
+    else:
+        frames = ifft(X, axis=1).real
+    x = _overlap_add(frames * win, step)
+    wsum = _window_power(win, step, M)
     pos = (wsum != 0)
-    x_pre = x.copy()
     ### Scale alignment for windows
     x[pos] /= wsum[pos]
     return x
@@ -75,9 +108,11 @@ def _istft(X, win, step):
 as to window function, hamming window is default
     and another option is hannig function.
 as to step size, stpe = fftLen/4 is default.
+as to onesided, the full complex spectrum is default;
+    onesided=True keeps only the fftLen//2+1 bins of a real signal.
 """
 
-def stft(data, fftLen, win=None, step=None):
+def stft(data, fftLen, win=None, step=None, onesided=False):
     
     if win is None:
         win = hamming(fftLen)
@@ -96,11 +131,11 @@ def stft(data, fftLen, win=None, step=None):
         print ("step is invalid.\n")
         sys.exit()
 
-    spectrogram = _stft(data, win, step)
+    spectrogram = _stft(data, win, step, onesided)
 
     return spectrogram
 
-def istft(spectrogram, fftLen, win=None, step=None):
+def istft(spectrogram, fftLen, win=None, step=None, onesided=False):
     
     if win is None:
         win = hamming(fftLen)
@@ -119,7 +154,7 @@ def istft(spectrogram, fftLen, win=None, step=None):
         print ("step is invalid.\n")
         sys.exit()
     
-    data = _istft(spectrogram, win, step)
+    data = _istft(spectrogram, win, step, onesided)
 
     return data
 
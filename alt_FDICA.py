@@ -4,6 +4,7 @@ import numpy as np
 from math import log
 from numpy.linalg import *
 from numpy.random import rand
+from whitening import whiten as _whiten
 
 """
 Author: Alex Bujan
@@ -23,7 +24,7 @@ def abs_sqr(W,X):
 
 def complex_FastICA(X,epsilon=.1,algorithm='parallel',\
                     max_iter=300,tol=1e-4,whiten=True,\
-                    w_init=None,n_components=None):
+                    w_init=None,n_components=None,track_EG=False):
     """Performs Fast Independent Component Analysis of complex-valued 
         signals
     Parameters
@@ -51,6 +52,10 @@ def complex_FastICA(X,epsilon=.1,algorithm='parallel',\
     n_components : int, optional
         Number of components to extract. If None, 
         n_components = n_features.
+    track_EG : boolean, optional
+        If True, record E[G(|W'*X|^2)] after every iteration 
+        (a convergence diagnostic that costs an extra pass 
+        over X per iteration). If False, EG is None.
     Returns
     -------
     W : array, shape (n_components, n_components)
@@ -59,9 +64,10 @@ def complex_FastICA(X,epsilon=.1,algorithm='parallel',\
         If whiten is 'True', K is the pre-whitening matrix 
         projecting the data onto the principal components. 
         If whiten is 'False', K is 'None'.
-    EG : array, shape(n_components,max_iter)
+    EG : array, shape(n_components,max_iter) | None
         Expectation of the contrast function E[G(|W'*X|^2)]. 
         This array may be padded with NaNs at the end.
+        Only computed if track_EG is True.
     S : array, shape (n_samples, n_components)
         Estimated sources (S = W K X).
     """
@@ -72,15 +78,11 @@ def complex_FastICA(X,epsilon=.1,algorithm='parallel',\
         n = n_components
 
     if whiten:
-        X-=X.mean(1,keepdims=True)
-        Ux,Sx = eig(np.cov(X))
-        K     = np.sqrt(inv(np.diag(Ux))).dot(Sx.conj().T)[:n]
-        X     = K.dot(X)
-        del Ux,Sx
+        X,K,_,_ = _whiten(X,n_components=n,ddof=1)
     else:
         K = None
 
-    EG = np.ones((n,max_iter))*np.nan
+    EG = np.ones((n,max_iter))*np.nan if track_EG else None
 
     if algorithm=='deflation':
 
@@ -117,7 +119,8 @@ def complex_FastICA(X,epsilon=.1,algorithm='parallel',\
                 w-=W.dot(W.conj().T).dot(w)
                 w/=norm(w)
 
-                EG[k,n_iter] = (np.log(epsilon+abs_sqr(w,X))).mean()
+                if track_EG:
+                    EG[k,n_iter] = (np.log(epsilon+abs_sqr(w,X))).mean()
 
                 n_iter+=1
 
@@ -147,23 +150,26 @@ def complex_FastICA(X,epsilon=.1,algorithm='parallel',\
 
             Wold = np.copy(W)
 
-            for j in range(n):
+            #all sources at once, W'*X is computed a single time
+            Y   = W.conj().T.dot(X)
+            aY  = abs(Y)**2
 
-                #derivative of the contrast function
-                g  =  (1/(epsilon+abs_sqr(W[:,j],X))).reshape((1,m))
-                #derivative of g
-                dg = -(1/(epsilon+abs_sqr(W[:,j],X))**2).reshape((1,m))
+            #derivative of the contrast function
+            g   = 1/(epsilon+aY)
+            #derivative of g
+            dg  = -g**2
 
-                W[:,j]  = (X * (W[:,j].conj().T.dot(X)).conj() * g).mean(1)-\
-                          (g + abs_sqr(W[:,j],X) * dg).mean() * W[:,j]
-                del g,dg
+            W   = X.dot((Y.conj()*g).T)/m-\
+                  (g + aY * dg).mean(1) * W
+            del Y,aY,g,dg
 
             # Symmetric decorrelation
             Uw,Sw = eig(W.conj().T.dot(C.dot(W)))
             W     = W.dot(Sw.dot(inv(np.sqrt(np.diag(Uw))).dot(Sw.conj().T)))
             del Uw,Sw
 
-            EG[:,n_iter] = (np.log(epsilon+abs_sqr(W,X))).mean(1)
+            if track_EG:
+                EG[:,n_iter] = (np.log(epsilon+abs_sqr(W,X))).mean(1)
 
             n_iter+=1
 
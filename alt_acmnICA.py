@@ -2,9 +2,10 @@ from __future__ import division
 import pdb
 import numpy as np
 from numpy.linalg import *
-from math import log,gamma
+from math import log
 from numpy.random import rand
-from scipy.special import psi,polygamma
+from scipy.special import gammaln,psi,polygamma
+from whitening import whiten
 import warnings
 
 
@@ -19,8 +20,25 @@ Date: 12/11/2015
 """
 
 
+"""
+Special-function terms of the shape Newton steps, each 
+evaluated once per step for all sources at once
+"""
+
+def _circ_terms(p):
+    """log(p), psi(1+1/p), polygamma(1,1+1/p)"""
+    return np.log(p),psi(1+1/p),polygamma(1,1+1/p)
+
+def _ggd_terms(c):
+    """log(gamma(2/c)/(2*gamma(1/c))), psi(1/c), psi(2/c), 
+    polygamma(1,1/c), polygamma(1,2/c)"""
+    return gammaln(2/c)-gammaln(1/c)-log(2),psi(1/c),psi(2/c),\
+           polygamma(1,1/c),polygamma(1,2/c)
+
+
 def ACMNsym(X,model='circ',p_init=1.25,\
-            max_iter=40,tol=1e-4,epsilon=.01):
+            max_iter=40,tol=1e-4,epsilon=.01,\
+            return_n_iter=False):
     """
     ICA of a complex-valued signal
     
@@ -31,24 +49,26 @@ def ACMNsym(X,model='circ',p_init=1.25,\
                   that has noncircular model
                 + circ assumes circular and 
                   runs mutch faster
+        tol   : the iteration stops as soon as the summed 
+                change of |W| drops below tol
+        return_n_iter : if True, the number of iterations 
+                is returned as well
     """
 
     n,m     = X.shape
 
     #Whitening
-    X-=X.mean(1,keepdims=True)
-    Dx,Ex   = eig(np.cov(X))
-    K       = np.sqrt(inv(np.diag(Dx))).dot(Ex.conj().T)
-    X       = K.dot(X)
+    X,K,IK,_ = whiten(X,ddof=1)
 
     #cache the pseudo-covariance
     pC      = X.dot(X.T)/m
 
     #initialized shape parameter 'p' for each source
-    params = np.repeat(p_init,n)
+    params = np.repeat(float(p_init),n)
 
     '''
     FIXED POINT ALGORITHM
+    all sources (columns of W) are updated at once
     '''
 
     #initialize the unmixing matrix
@@ -59,83 +79,84 @@ def ACMNsym(X,model='circ',p_init=1.25,\
 
         Wold = np.copy(W)
 
+        '''
+        1) Calculate current source estimates Y = WHX
+        '''
 
-        for kk in range(n): 
+        Y = W.conj().T.dot(X)
 
-            '''
-            1) Calculate current source estimate y = WHX
-            '''
+        '''
+        2) Update W
+        '''
 
-            y = W[:,kk].reshape((n,1)).conj().T.dot(X)
+        if model=='noncirc':
 
-            '''
-            2) Update W
-            '''
+            p = params[:,np.newaxis]
 
-            if model=='noncirc':
+        elif model=='circ':
 
-                p = params[kk]
+            p = params[:,np.newaxis]/2
 
-            elif model=='circ':
+        abs_y    = abs(Y)**2
 
-                p = params[kk]/2
+        u       = abs_y + epsilon
 
-            abs_y    = abs(y)**2
+        u1      = p * u**(p-1)
+        u2      = p * (p-1) * u**(p-2)
 
-            u       = abs_y + epsilon
+        gRad    = X.dot((u1*Y.conj()).T)/m
+        ggg     = (u2*abs_y+u1).mean(1)
+        b       = (u2*Y.conj()**2).mean(1)
 
-            u1      = p * u**(p-1)
-            u2      = p * (p-1) * u**(p-2)
+        W       = Wold*ggg - gRad + pC.dot(Wold.conj())*b
 
-            gRad    = ((u1*y.conj())*X).mean(1)
-            ggg     = (u2*abs_y+u1).mean()
-            B       = (u2*y.conj()**2).mean()*pC
+        '''
+        3) Estimate p
+        '''
 
-            W[:,kk] = Wold[:,kk]*ggg - gRad + B.dot(Wold[:,kk].conj())
+        if model=='noncirc':
 
-            '''
-            3) Estimate p
-            '''
+            aug_y    = np.stack([Y.conj(),Y],axis=1)
 
-            if model=='noncirc':
+            params   = estimateGGDCovShapeIn(aug_y,params)
 
-                aug_y    = np.concatenate([y.T,y.conj().T],axis=1).conj().T
+        elif model=='circ':
 
-                params[kk] = estimateGGDCovShapeIn(aug_y,params[kk])
+            # Newton estimate of p
 
-            elif model=='circ':
+            p     = params
 
-                # Newton estimate of p
+            abs_y = abs(Y)
 
-                p     = params[kk]
+            u     = abs_y + epsilon
 
-                abs_y = abs(y)
+            up    = u**p[:,np.newaxis]
 
-                u     = abs_y + epsilon
+            sigP  = ((abs_y**p[:,np.newaxis]).mean(1)**(1/p))[:,np.newaxis]
 
-                up    = u**p
+            q     = p[:,np.newaxis]
 
-                sigP  = (abs_y**p).mean()**(1/p)
+            log_p,psi_p,tri_p = _circ_terms(p)
 
-                gp    = -(1/p**2) * log(p) + (1/p**2) - \
-                          psi(1+1/p) * (1/p**2) + \
-                          ( (1/(sigP**p*p)) * up * (np.log(u) - \
-                          ((1/p) + log(sigP)) ) ).mean()
+            gp    = -(1/p**2) * log_p + (1/p**2) - \
+                      psi_p * (1/p**2) + \
+                      ( (1/(sigP**q*q)) * up * (np.log(u) - \
+                      ((1/q) + np.log(sigP)) ) ).mean(1)
 
-                ggp   = 2*(1/p**3)*log(p) - 3*(1/p**3) + \
-                          float(polygamma(1,1+1/p))*(1/p**4) + \
-                          2*psi(1+1/p)*(1/p**3) + \
-                          ( (1/(p*sigP**p)) * up * \
-                          ( np.log(u)**2 - 2*(1/p)*np.log(u) - \
-                          2*log(sigP)*np.log(u) + \
-                          (2*(1/p**2) + 2*log(sigP)*(1/p) + \
-                          log(sigP)**2) ) ).mean()
+            ggp   = 2*(1/p**3)*log_p - 3*(1/p**3) + \
+                      tri_p*(1/p**4) + \
+                      2*psi_p*(1/p**3) + \
+                      ( (1/(q*sigP**q)) * up * \
+                      ( np.log(u)**2 - 2*(1/q)*np.log(u) - \
+                      2*np.log(sigP)*np.log(u) + \
+                      (2*(1/q**2) + 2*np.log(sigP)*(1/q) + \
+                      np.log(sigP)**2) ) ).mean(1)
 
-                p-=(gp/ggp)
-                p = np.maximum(p,.2)
-                p = np.minimum(p,3)
+            p     = p-(gp/ggp)
+            p     = np.maximum(p,.2)
+            p     = np.minimum(p,3)
 
-                params[kk] = p
+            params = p
 
         '''
         4) Normalize W (symmetric decorrelation)
@@ -149,68 +170,88 @@ def ACMNsym(X,model='circ',p_init=1.25,\
         '''
 
         if (abs(abs(Wold)-abs(W))).sum() < tol:
-                warnings.warn('ACMN did not converge. Consider increasing '
-                      'the maximum number of iterations or decreasing the '
-                      'threshold for stopping joint diagonalization.')
+            break
+
+    else:
+        warnings.warn('ACMN did not converge. Consider increasing '
+                      'the maximum number of iterations or the '
+                      'tolerance.')
 
     S = W.conj().T.dot(X)
-    A = inv(K).dot(W)
+    A = IK.dot(W)
+
+    if return_n_iter:
+        return A,S,K,W,k+1
 
     return A,S,K,W
 
 def estimateGGDCovShapeIn(X,p_init):
+    """
+    One Newton step for the shape parameter of a generalized 
+    Gaussian model of X
+
+    Input:
+        X      : augmented samples, shape (d, N), or a stack of 
+                 them, shape (..., d, N), e.g. one source per 
+                 frequency bin
+        p_init : current shape parameter, float or array of 
+                 shape (...) for a stack
+    Output:
+        c      : updated shape parameter, clipped to [.05, 4]
+    """
+
+    X = np.asarray(X)
+    N = X.shape[-1]
 
-    N = X.shape[1]
-    R = np.cov(X)
+    Xc = X-X.mean(-1,keepdims=True)
+    R  = np.matmul(Xc,Xc.conj().swapaxes(-1,-2))/(N-1)
 
     #start at Gaussian
-    bestC       = p_init
+    bestC       = np.asarray(p_init,dtype=float)
     c           = bestC
 
-    Rold        = np.zeros((2,2),dtype=np.complex)
+    #all quadratic forms x_n^H R^-1 x_n with a single inverse
+    temp    = np.einsum('...in,...ij,...jn->...n',X.conj(),inv(R),X).real
+    tempC   = temp**c[...,np.newaxis]
+    logT    = np.log(temp)
 
-    xRxC        = 0
-    dirXRX      = 0
-    dirXRX2     = 0
+    xRxC    = tempC.sum(-1)
+    dirXRX  = (logT*tempC).sum(-1)
+    dirXRX2 = (logT**2*tempC).sum(-1)
 
-    for n in range(N):
-        temp    = X[:,n].conj().T.dot(inv(R)).dot(X[:,n])
-        xRxC    += (temp**c).real
-        dirXRX  += (log(temp)*temp**c).real
-        dirXRX2 += (log(temp)**2*temp**c).real
+    log_c2,psi1,psi2,tri1,tri2 = _ggd_terms(c)
 
-    c2  = gamma(2*1/c)/(2*gamma(1/c))
+    c2  = np.exp(log_c2)
 
-    c2p = log(c2) - (1/c) * 2*psi(2*1/c) - psi(1/c)
+    c2p = log_c2 - (1/c) * 2*psi2 - psi1
 
-    gc  = N * ( (1/c) - (1/c**2) * 2*psi(2*1/c) + \
-          (1/c**2) * 2*psi(1/c) ) - \
+    gc  = N * ( (1/c) - (1/c**2) * 2*psi2 + \
+          (1/c**2) * 2*psi1 ) - \
           (c2**c) * (c2p*xRxC + dirXRX)
 
     ##Second dir
-    A   = N * ( (4*psi(2*1/c)/c**3) + \
-          (4*polygamma(1,2*1/c)/c**4) - \
-          (1/c**2) - (4*psi(1/c)/c**3) - \
-          (2*polygamma(1,1/c)/c**4) )
+    A   = N * ( (4*psi2/c**3) + \
+          (4*tri2/c**4) - \
+          (1/c**2) - (4*psi1/c**3) - \
+          (2*tri1/c**4) )
 
     #Dir c2**c
-    dc2C = log(c2)*(c2**c) - \
-           c*(c2**(c-1))*(c2*2*psi(2*1/c)/c**2 - \
-           c2*psi(1/c)/c**2)
+    dc2C = log_c2*(c2**c) - \
+           c*(c2**(c-1))*(c2*2*psi2/c**2 - \
+           c2*psi1/c**2)
 
-    dc2p = -((psi(1/c) - 2*psi(2*1/c))/c**2) - \
-            ((polygamma(1,1/c) - 4 * polygamma(1,2*1/c))/c**3)-\
-            ((2*psi(2*1/c)/c**2) - psi(1/c)/c**2)
+    dc2p = -((psi1 - 2*psi2)/c**2) - \
+            ((tri1 - 4 * tri2)/c**3)-\
+            ((2*psi2/c**2) - psi1/c**2)
 
     B = dc2C*c2p*xRxC + c2**c * (dc2p*xRxC + c2p*dirXRX)
 
     C = dc2C*dirXRX + c2**c * dirXRX2
 
     ggc     = A-B-C
-    cold    = c
     cn      = c - (1/ggc) * gc
 
     #Newton update with no negatives
-    c       = min(4,max(.05,cn))
+    c       = np.minimum(4,np.maximum(.05,cn))
 
-    return c
\ No newline at end of file
+    return c if c.ndim else float(c)
@@ -1,10 +1,11 @@
 from __future__ import division
-import pdb,os,time,warnings
+import pdb,os,time
 import numpy as np
 from math import log
 from numpy.linalg import *
 from numpy.random import rand
-from scipy.linalg import sqrtm
+from whitening import covariance_eigh, whiten
+from joint_diag import joint_diagonalize
 
 def jade(X,m=None,max_iter=100,nem=None,tol=None):
     """Source separation of complex signals via Joint Approximate 
@@ -43,7 +44,30 @@ def jade(X,m=None,max_iter=100,nem=None,tol=None):
     Date: 20/01/2016
     """
 
-    n,T = X.shape
+    return jade_batch(X,m,max_iter,nem,tol)
+
+def jade_batch(X,m=None,max_iter=100,nem=None,tol=None):
+    """JADE of a stack of independent mixtures, e.g. one per 
+        frequency bin or per segment
+    Parameters
+    ----------
+    X : array, shape (..., n_mixtures, n_samples)
+        Stack of mixtures, a single matrix is allowed as well
+    m, max_iter, nem, tol : see jade
+    Returns
+    -------
+    A, S, W, V : arrays with the leading dimensions of X, see jade
+    Notes
+    -----
+    Whitening, cumulant estimation and the eigen-matrices are 
+    computed for the whole stack at once. The joint 
+    diagonalization runs on all problems together, problems drop 
+    out of the sweeps as soon as they have converged.
+    """
+
+    X   = np.asarray(X)
+    n,T = X.shape[-2:]
+    batch = X.shape[:-2]
 
     if m==None:
         m = n
@@ -58,120 +82,66 @@ def jade(X,m=None,max_iter=100,nem=None,tol=None):
     whitening
     '''
 
-    X-=X.mean(1,keepdims=True)
-
     if m<n:
         #assumes white noise
-        D,U     = eig((X.dot(X.conj().T))/T)
-        k       = np.argsort(D)
-        puiss   = D[k]
-        ibl     = np.sqrt(puiss[-m:]-puiss[:-m].mean())
+        X_mean,puiss,U = covariance_eigh(X)
+        X       = X-X_mean[...,np.newaxis]
+        ibl     = np.sqrt(puiss[...,-m:]-\
+                          puiss[...,:-m].mean(-1,keepdims=True))
         bl      = 1/ibl
-        W       = np.diag(bl).dot(U[:,k[-m:]].conj().T)
-        IW      = U[:,k[-m:]].dot(np.diag(ibl))
+        W       = bl[...,np.newaxis]*U[...,-m:].conj().swapaxes(-1,-2)
+        IW      = U[...,-m:]*ibl[...,np.newaxis,:]
+        Y       = np.matmul(W,X)
     else:
         #assumes no noise
-        IW      = sqrtm((X.dot(X.conj().T))/T)
-        W       = inv(IW)
+        Y,W,IW,_ = whiten(X,method='zca')
 
-    Y    = W.dot(X)
+    YH   = Y.conj().swapaxes(-1,-2)
 
     '''
     Cumulant estimation
     '''
 
     #covariance
-    R    = Y.dot(Y.conj().T)/T
+    R    = np.matmul(Y,YH)/T
     #pseudo-covariance
-    C    = Y.dot(Y.T)/T
-
-    Q    = np.zeros((m*m*m*m,1),dtype=np.complex)
-    idx  = 0
-
-    for lx in range(m):
-        Yl = Y[lx]
-        for kx in range(m):
-            Ykl = Yl*Y[kx].conj()
-            for jx in range(m):
-                Yjkl = Ykl*Y[jx].conj()
-                for ix in range(m):
-                    Q[idx] = Yjkl.dot(Y[ix].T)/T-\
-                               R[ix,jx]*R[lx,kx]-\
-                               R[ix,kx]*R[lx,jx]-\
-                               C[ix,lx]*np.conj(C[jx,kx])
-                    idx+=1
+    C    = np.matmul(Y,Y.swapaxes(-1,-2))/T
+
+    #fourth moments E[Y_l Y_i conj(Y_k Y_j)] only depend on the 
+    #unordered pairs (l,i) and (k,j), so they are computed once 
+    #per pair of products Y_a Y_b with a<=b
+    a,b       = np.triu_indices(m)
+    pair      = np.zeros((m,m),dtype=int)
+    pair[a,b] = pair[b,a] = np.arange(len(a))
+    P         = Y[...,a,:]*Y[...,b,:]
+    E4        = np.matmul(P,P.conj().swapaxes(-1,-2))/T
+
+    #Q[...,l,k,j,i]
+    Q    = E4[...,pair[:,None,None,:],pair[None,:,:,None]]-\
+           np.einsum('...ij,...lk->...lkji',R,R)-\
+           np.einsum('...ik,...lj->...lkji',R,R)-\
+           np.einsum('...il,...jk->...lkji',C,C.conj())
 
     '''
     computation and reshaping of the significant eigen matrices
     '''
-    D,U = eig(Q.reshape((m*m,m*m)))
-    K   = np.argsort(abs(D))
-    la  = abs(D)[K]
-    M   = np.zeros((m,nem*m),dtype=np.complex)
-    h   = (m*m)-1
-    for u in np.arange(0,nem*m,m):
-        M[:,u:u+m] = la[h]*U[:,K[h]].reshape((m,m))
-        h-=1
+    #the cumulant matrix is Hermitian
+    D,U = eigh(Q.reshape(batch+(m*m,m*m)))
+    K   = np.argsort(abs(D),axis=-1)[...,::-1][...,:nem]
+    D   = np.take_along_axis(abs(D),K,axis=-1)
+    U   = np.take_along_axis(U,K[...,np.newaxis,:],axis=-1)
+    M   = (U*D[...,np.newaxis,:]).swapaxes(-1,-2)
+    M   = M.reshape(batch+(nem,m,m))
 
     '''
     joint approximate diagonalization of the eigen-matrices
     '''
-    B       = np.array([[1,0,0],[0,1,1],[0,0,0]])+\
-              1j*np.array([[0,0,0],[0,0,0],[0,-1,1]])
-    Bt      = B.conj().T
-    V       = np.eye(m).astype(np.complex)
-
-    encore  = True
-
-    #Main loop
-
-    for n_iter in range(max_iter):
-
-        for p in range(m-1):
-
-            for q in np.arange(p+1,m):
-
-                Ip = np.arange(p,nem*m,m)
-                Iq = np.arange(q,nem*m,m)
-
-                #Computing the Givens angles
-                g       = np.vstack([M[p,Ip]-M[q,Iq],M[p,Iq],M[q,Ip]])
-                D,vcp   = eig(np.real(B.dot(g.dot(g.conj().T)).dot(Bt)))
-                K       = np.argsort(D)
-                la      = D[K]
-
-                angles  = vcp[:,K[2]]
-
-                if angles[0]<0:
-                    angles*=-1
-
-                c    = np.sqrt(.5+angles[0]/2)
-                s    = .5*(angles[1]-1j*angles[2])/c
-
-                #updates matrices M and V by a Givens rotation
-                if abs(s)>tol:
-                    pair            = np.hstack((p,q))
-                    G               = np.vstack(([c,-s.conj()],[s,c]))
-                    V[:,pair]       = V[:,pair].dot(G)
-                    M[pair,:]       = G.conj().T.dot(M[pair,:])
-                    ids             = np.hstack((Ip,Iq))
-                    M[:,ids]        = np.hstack((c*M[:,Ip]+s*M[:,Iq],\
-                                                 -s.conj()*M[:,Ip]+c*M[:,Iq]))
-                else:
-                    encore          = False
-
-        if encore==False:
-            break
-
-    if n_iter+1==max_iter:
-        warnings.warn('JadeICA did not converge. Consider increasing '
-                      'the maximum number of iterations or decreasing the '
-                      'threshold for stopping joint diagonalization.')
+    V,_,n_iter = joint_diagonalize(M,max_iter=max_iter,tol=tol)
 
     '''
     estimation of the mixing matrix and sources
     '''
-    A    = IW.dot(V)
-    S    = V.conj().T.dot(Y)
+    A    = np.matmul(IW,V)
+    S    = np.matmul(V.conj().swapaxes(-1,-2),Y)
 
-    return A,S,W,V
\ No newline at end of file
+    return A,S,W,V
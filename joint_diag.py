@@ -0,0 +1,167 @@
+import warnings
+from functools import lru_cache
+import numpy as np
+
+
+"""
+Joint approximate diagonalization of a set of matrices by Givens rotations, shared by JADE and SOBI.
+
+Source: Cardoso, J.-F.; Souloumiac, A.: Jacobi angles for simultaneous diagonalization.
+SIAM Journal on Matrix Analysis and Applications 17 (1996), Nr. 1, S. 161-164
+
+Every sweep visits all pairs (p, q) in round-robin order: the m/2 pairs of a round are disjoint, so their
+rotations commute and a whole round is applied at once to all target matrices and to all problems of a stack.
+The Givens angles come in closed form from the dominant eigenvector of a real symmetric 3 x 3 matrix.
+"""
+
+@lru_cache(maxsize=None)
+def _round_robin(m):
+    """
+    splits all pairs p < q of range(m) into m - 1 (m even) or m (m odd) rounds of disjoint pairs
+
+    :param integer m: size of the matrices
+    :return: tuple of (p, q) index arrays, one per round
+    """
+    players = list(range(m)) + ([-1] if m % 2 else [])
+    n = len(players)
+    rounds = []
+    for r in range(n - 1):
+        pairs = [(players[i], players[n - 1 - i]) for i in range(n // 2)]
+        pairs = sorted((min(a, b), max(a, b)) for a, b in pairs if a >= 0 and b >= 0)
+        if pairs:
+            rounds.append((np.array([a for a, _ in pairs]), np.array([b for _, b in pairs])))
+        players = [players[0], players[-1]] + players[1:-1]
+    return tuple(rounds)
+
+
+def _dominant_eigenvector(G):
+    """
+    closed-form eigenvector of the largest eigenvalue of real symmetric 3 x 3 matrices
+
+    :param G: array, shape (..., 3, 3)
+    :return: unit eigenvectors (..., 3), zero where the largest eigenvalue is not simple
+    """
+    a, b, c = G[..., 0, 0], G[..., 1, 1], G[..., 2, 2]
+    d, e, f = G[..., 0, 1], G[..., 0, 2], G[..., 1, 2]
+
+    #largest root of the characteristic polynomial (trigonometric solution)
+    q = (a + b + c) / 3
+    aq, bq, cq = a - q, b - q, c - q
+    p = np.sqrt((aq ** 2 + bq ** 2 + cq ** 2 + 2 * (d ** 2 + e ** 2 + f ** 2)) / 6)
+    det = aq * (bq * cq - f * f) - d * (d * cq - f * e) + e * (d * f - bq * e)
+    r = np.clip(det / np.where(p > 0, 2 * p ** 3, 1), -1, 1)
+    la = q + 2 * p * np.cos(np.arccos(r) / 3)
+
+    #the eigenvector is orthogonal to the rows of G - la I: take the longest of their cross products
+    al, bl, cl = a - la, b - la, c - la
+    cross = np.array([[d * f - e * bl, e * d - al * f, al * bl - d * d],
+                      [d * cl - e * f, e * e - al * cl, al * f - d * e],
+                      [bl * cl - f * f, f * e - d * cl, d * f - bl * e]])
+    norm = (cross ** 2).sum(1)
+    best = norm.argmax(0)
+    v = np.choose(best, cross)
+    n = np.sqrt(np.choose(best, norm))
+
+    #the cross products are of the order p^2 unless the largest eigenvalue is (nearly) repeated
+    simple = n > np.finfo(float).eps * (3 * p) ** 2
+    return np.moveaxis(np.where(simple, v / np.where(simple, n, 1), 0), 0, -1)
+
+
+def givens_angles(g):
+    """
+    closed-form Givens rotation [[c, -conj(s)], [s, c]] that best jointly diagonalizes one pair (p, q)
+
+    :param g: array, shape (3, ..., K): M_pp - M_qq, M_pq and M_qp of the K target matrices
+    :return: c (...) real, s (...) complex; c = 1, s = 0 where no rotation is preferred
+    """
+    #h = B g with B = [[1, 0, 0], [0, 1, 1], [0, -i, i]] maps the pair statistics to a real 3 x 3 problem
+    h = np.stack([g[0], g[1] + g[2], 1j * (g[2] - g[1])])
+    G = np.einsum('a...k,b...k->...ab', h, h.conj()).real
+    angles = _dominant_eigenvector(G)
+    angles *= np.where(angles[..., :1] < 0, -1, 1)
+
+    c = np.sqrt(.5 + angles[..., 0] / 2)
+    s = .5 * (angles[..., 1] - 1j * angles[..., 2]) / c
+    unrotated = ~angles.any(-1)
+    if unrotated.any():
+        c = np.where(unrotated, 1, c)
+        s = np.where(unrotated, 0, s)
+    return c, s
+
+
+def _sweep(M, V, tol):
+    """
+    one sweep over all pairs, M (P, K, m, m) and V (P, m, m) are rotated in place
+
+    :return: boolean array (P,), True for the problems that needed a rotation with |s| > tol
+    """
+    m = M.shape[-1]
+    rotated = np.zeros(M.shape[0], dtype=bool)
+
+    for p, q in _round_robin(m):
+
+        g = np.stack([M[:, :, p, p] - M[:, :, q, q], M[:, :, p, q], M[:, :, q, p]]).transpose(0, 1, 3, 2)
+        c, s = givens_angles(g)
+
+        #rotations below the threshold are skipped
+        big = abs(s) > tol
+        if not big.any():
+            continue
+        rotated |= big.any(1)
+        c, s = np.where(big, c, 1), np.where(big, s, 0)
+
+        #M <- G^H M G and V <- V G for all pairs of the round at once
+        cr, sr = c[:, None, :, None], s[:, None, :, None]
+        Mp, Mq = M[:, :, p, :], M[:, :, q, :]
+        M[:, :, p, :], M[:, :, q, :] = cr * Mp + sr.conj() * Mq, cr * Mq - sr * Mp
+
+        cc, sc = c[:, None, None, :], s[:, None, None, :]
+        Mp, Mq = M[:, :, :, p], M[:, :, :, q]
+        M[:, :, :, p], M[:, :, :, q] = cc * Mp + sc * Mq, cc * Mq - sc.conj() * Mp
+
+        Vp, Vq = V[:, :, p], V[:, :, q]
+        V[:, :, p], V[:, :, q] = cc[:, 0] * Vp + sc[:, 0] * Vq, cc[:, 0] * Vq - sc[:, 0].conj() * Vp
+
+    return rotated
+
+
+def joint_diagonalize(M, max_iter=100, tol=1e-6):
+    """
+    finds the unitary V for which the matrices V^H M_k V are as diagonal as possible
+
+    :param M: array, shape (..., K, m, m): K target matrices per problem, any leading dimensions hold independent problems
+    :param integer max_iter: maximum number of sweeps over all pairs
+    :param float tol: a problem has converged when a whole sweep needs no rotation with |s| > tol
+    :return: V (..., m, m), the rotated matrices V^H M V (..., K, m, m), the number of sweeps per problem (...)
+    """
+    M = np.array(M, dtype=complex)
+    batch = M.shape[:-3]
+    K, m = M.shape[-3], M.shape[-1]
+    M = M.reshape((-1, K, m, m))
+    P = M.shape[0]
+
+    V = np.tile(np.eye(m, dtype=complex), (P, 1, 1))
+    n_iter = np.zeros(P, dtype=int)
+    active = np.ones(P, dtype=bool)
+
+    for sweep in range(max_iter):
+
+        #converged problems drop out of the sweeps
+        idx = np.flatnonzero(active)
+        if len(idx) == P:
+            rotated = _sweep(M, V, tol)
+        else:
+            M_active, V_active = M[idx], V[idx]
+            rotated = _sweep(M_active, V_active, tol)
+            M[idx], V[idx] = M_active, V_active
+
+        n_iter[idx] += 1
+        active[idx] = rotated
+        if not active.any():
+            break
+
+    else:
+        warnings.warn('Joint diagonalization did not converge for %d of %d problems. Consider increasing '
+                      'the maximum number of iterations or the threshold for stopping.' % (active.sum(), P))
+
+    return V.reshape(batch + (m, m)), M.reshape(batch + (K, m, m)), n_iter.reshape(batch)
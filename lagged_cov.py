@@ -0,0 +1,45 @@
+import numpy as np
+
+
+"""
+Time-lagged covariance matrices of multichannel signals through FFT-based cross-correlation.
+
+All cross-correlations of n channels follow from one FFT per channel and n^2 inverse FFTs, independent of the
+number of lags, instead of one covariance pass over the data per lag. Leading dimensions of the input are
+independent problems (e.g. the frequency bands of an RSCD segment) and are processed at once.
+"""
+
+
+def _next_pow2(n):
+    return 1 << int(np.ceil(np.log2(max(n, 1))))
+
+
+def lagged_covariances(X, lags, center=True):
+    """
+    time-lagged covariances R_tau[i, j] = 1/(T - |tau|) sum_t x_i(t + tau) conj(x_j(t))
+
+    :param X: array, shape (..., n_channels, T)
+    :param lags: integer lags, |tau| < T; negative lags give R_-tau = R_tau^H
+    :param center: subtract the mean of every channel first
+    :return: array, shape (..., n_lags, n_channels, n_channels)
+    """
+    X = np.asarray(X)
+    lags = np.atleast_1d(np.asarray(lags, dtype=int))
+    T = X.shape[-1]
+    if np.any(np.abs(lags) >= T):
+        raise ValueError('all lags must be shorter than the signal length %d' % T)
+
+    if center:
+        X = X - X.mean(axis=-1, keepdims=True)
+
+    #zero padding to at least T + max|tau| keeps the circular correlation free of wrap-around
+    n_fft = _next_pow2(T + int(np.abs(lags).max()))
+    F = np.fft.fft(X, n_fft, axis=-1)
+
+    #cross-spectra of all channel pairs, C[..., i, j, :] = corr(x_i, x_j)
+    C = np.fft.ifft(F[..., :, np.newaxis, :] * np.conj(F[..., np.newaxis, :, :]), axis=-1)
+    if not np.iscomplexobj(X):
+        C = C.real
+
+    R = C[..., lags % n_fft] / (T - np.abs(lags))
+    return np.moveaxis(R, -1, -3)
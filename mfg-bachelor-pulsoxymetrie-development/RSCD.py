@@ -1,9 +1,17 @@
 import csv
+import itertools
+import os
+import sys
 import numpy as np
 import scipy.stats
 from scipy import signal
 import matplotlib.pyplot as plt
-import math
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from whitening import whitening_matrix
+from joint_diag import joint_diagonalize
+from lagged_cov import lagged_covariances
+from segmenter import segment, stft_segments
 
 
 def RSCD(data, fs=50):
@@ -13,57 +21,52 @@ def RSCD(data, fs=50):
     1. imports the time signal from csv into two arrays (normalized_R - normalized time signal of the reflection in the red sprectrum, normalized_IR - normalized time signal of the reflection in the infrared spectrum).
     2. Overlap-add: turns the two arrays into segments of 10.24 seconds with with the bartlett window.
     3. Short-time Fourier transform (STFT): transforms every segment of part 2 with the STFT into 17 frequency bands (segments = 32, overlap = 24)
+       -> parts 2 and 3 are computed together: one STFT of the whole recording, the bartlett window weights the frames of every segment
     4. prewhites a set of 17 frequency bands to decorrelate the signals (preparation for the ICA in step 5) -> FIXME: mean the signal before!
     5. Independed Component Analysis (ICA): Uses a statistcal second order demixing method on every sequency band to demix the signals
-    6. ToDo: permutation correction of the 17 demixed frequenz bands (try a new algorithm for a better running time -> now > 65!)
+    6. permutation correction of the 17 demixed frequenz bands (correlations of all bands as one normalized Gram matrix, every band is sorted like the best correlated band)
     7. Inverse Short-time Fourier transform (ISTFT): transforms the 17 demixed frequenz bands with the ISTFT
     8. entropy method: matches the demixed signals either to the pulse-signal or the artefact by using the statistical entropy
     9. ToDo: calculates the SpO2 - Value with the demixing matrice from part 5.
 
     :param string data:  path to the csv file with the reflection-data of the red and infrared reflection
     :param integer fs: sampling frequency
-    :return: [integer], [integer]: time-signal of the pulse, SPO2-Value
+    :return: demixed time-signals of every segment, shape (n_segments, 2, n) (ToDo: time-signal of the pulse, SPO2-Value)
     """
 
     normalized_R, normalized_IR = import_data(data)
 
-    normalized_R_segments = overlap_add(normalized_R)
-    normalized_IR_segments = overlap_add(normalized_IR)
-    entmischte_Segmente_R = []
-    entmischte_Segmente_IR = []
-
-    for i in range(len(normalized_R_segments)):
-
-        f_R, t_R, Zxx_R = signal.stft(normalized_R_segments[i], fs=fs, nperseg=32, noverlap=24)
-        # plot(t_R, f_R, Zxx_R)
+    # STFT of the whole recording once, split up into the frames of the overlap-add segments (512/256, bartlett-window)
+    f, t, Zxx_R_segments = stft_segments(normalized_R, fs, 512, 256, nperseg=32, noverlap=24)
+    f, t, Zxx_IR_segments = stft_segments(normalized_IR, fs, 512, 256, nperseg=32, noverlap=24)
+    entmischte_Segmente = []
 
-        prewhitened_R = prewhitening(Zxx_R)
-        plot(t_R, f_R, prewhitened_R)
-        entmischte_R_frequenzband = []
+    for i in range(len(Zxx_R_segments)):
 
-        for k in range(len(Zxx_R)):
-            entmischte_R_frequenzband.append(np.dot(SOBI(prewhitened_R[k]), prewhitened_R[k]))
+        Zxx_R, Zxx_IR = Zxx_R_segments[i], Zxx_IR_segments[i]
+        # plot(t, f, Zxx_R)
 
-        # plot(t_R, f_R, entmischte_R_frequenzband)
-        sortierte_entmischte_frequenzbänder_R = permutation_correction(entmischte_R_frequenzband)
+        # every frequency band is a mixture of the two channels R and IR: shape (n_bands, 2, n_frames)
+        Zxx = np.stack((Zxx_R, Zxx_IR), axis=1)
 
-        sortierte_entmischte_Segmente_R = signal.istft(sortierte_entmischte_frequenzbänder_R)
+        prewhitened = prewhitening(Zxx)
+        plot(t, f, prewhitened[:, 0])
 
-        entmischte_Segmente_R.append(sortierte_entmischte_Segmente_R)
+        # demixing matrices and diagonalized time shifted covariances of all frequency bands at once
+        demixing, covariance_diagonals = SOBI(prewhitened)
+        entmischte_frequenzbaender = np.matmul(demixing, prewhitened)
 
-    for j in range(len(normalized_IR_segments)):
+        # plot(t, f, entmischte_frequenzbaender[:, 0])
+        # sorts the demixed signals of every frequency band into the order of the reference band
+        permutations = permutation_alignment(covariance_diagonals)
+        entmischte_frequenzbaender = np.take_along_axis(entmischte_frequenzbaender, permutations[:, :, np.newaxis], axis=1)
 
-        f_IR, t_IR, Zxx_IR = signal.stft(normalized_IR_segments[j], fs=fs, nperseg=32, noverlap=24)
-        prewhitened_IR = prewhitening(Zxx_IR)
+        t_segment, entmischtes_Segment = signal.istft(entmischte_frequenzbaender.transpose(1, 0, 2), fs=fs,
+                                                      nperseg=32, noverlap=24)
 
-        entmischte_IR_frequenzband = []
+        entmischte_Segmente.append(entmischtes_Segment)
 
-        for l in range(len(Zxx_IR)):
-            entmischte_IR_frequenzband.append(np.dot(SOBI(prewhitened_IR[l], prewhitened_IR[l])))
-
-        sortierte_entmischte_frequenzbänder_IR = permutation_correction(entmischte_IR_frequenzband)
-        sortierte_entmischte_Segmente_IR = signal.istft(sortierte_entmischte_frequenzbänder_IR)
-        entmischte_Segmente_IR.append(sortierte_entmischte_Segmente_IR)
+    return np.array(entmischte_Segmente)
 
 
 def import_data(data):
@@ -101,16 +104,12 @@ def prewhitening(data):
     """
     prewhitening decorrelates the data (Dissertation by Volmer maybe shows the wrong equation): we used: X_whiten = E * D^(-1/2) * E^T * x
     Source: Unterdrückung von Bewegungsartefakten beim Langzeitmonitoring zur Anwendung in Personal-Healthcare-Systemen, Achim Volmer, p. 123 eq. 6.53
-    :param [[np.complex]] data: Zxx after STFT
+    :param [[np.complex]] data: Zxx after STFT, or a stack of mixtures of shape (..., n_channels, n_frames)
     :return: [[np.complex]]
     """
     # data = center(data) # TODO: center the data!
-    cov = np.cov(data)
-
-    d, E = np.linalg.eigh(cov)
-    D = np.diag(d)
-    D_inv = np.sqrt(np.linalg.inv(D))
-    X_whiten = np.dot(E, np.dot(D_inv, np.dot(E.T, data)))
+    whitening = whitening_matrix(data, method='zca', ddof=1)[0]  # E * D^(-1/2) * E^H of np.cov(data)
+    X_whiten = np.matmul(whitening, data)
 
     return X_whiten
 
@@ -122,96 +121,38 @@ def overlap_add(data, n=512, overlap=256):
     :param [float] data: imported time-signals
     :param integer n: Length of Segment
     :param integer overlap: length of overlap
-    :return: array of segments
+    :return: array of segments, shape (n_segments, n)
     """
-    segments = []
-
-    for i in range(0, len(data), n - overlap):
-
-        if i + n > len(data):  # cuts the last signals from the data, if they are not long enough, for a segment.
-            break
-
-        segment = data[i:i + n]
-        segment = segment * np.bartlett(n)
-        segments.append(segment)
+    # strided view of the data, the (cached) window is applied to all segments at once
+    segments = segment(data, n, overlap, window='bartlett')
 
     return segments
 
 
-def SOBI(data, set_cov=50):
+def SOBI(data, set_cov=50, lags=None):
     """
     Second Order Blind Identification (SOBI): calculates the demixing matrix by a statistical second order method.
     source: Unterdrückung von Bewegungsartefakten beim Langzeitmonitoring zur Anwendung in Personal-Healthcare-Systemen, Achim Volmer, p. 128 ff. section 6.9.4.
-    :param [np.complex] data: the frequency band, to calculate the demixing matrix for
-    :param integer set_cov: number of time shifted covariances, used as Cov_set to calculate the demixing-matrix.
-    :return: demixing matrix for the frequency band
+    :param [np.complex] data: array, shape (..., n_channels, n_frames), the (prewhitened) frequency band(s), leading dimensions (e.g. all frequency bands of a segment) are demixed at once
+    :param integer set_cov: number of time shifted covariances, used as Cov_set to calculate the demixing-matrix (lags 1 ... set_cov).
+    :param [integer] lags: time shifts of the Cov_set, overrides set_cov
+    :return: demixing matrices V^H (..., n_channels, n_channels), V jointly diagonalizes the Cov_set,
+             diagonals of the diagonalized Cov_set (..., n_lags, n_channels), the input of permutation_correction
     """
-    Cov_set = []
-    zero_padding = np.zeros(set_cov)
-    data_padded = np.append(data, zero_padding)
+    data = np.asarray(data)
+    n_frames = data.shape[-1]
 
-    for i in range(set_cov):
-        X = np.vstack((data, data_padded[i + 1:i + 65 + 1]))
-        Cov_set.append(np.cov(X.T))
+    if lags is None:
+        lags = np.arange(1, min(set_cov, n_frames - 1) + 1)
 
-    Sum_Cov = Cov_set[0]
+    # all time shifted covariances of all bands via FFT-based cross-correlation, Hermitian part as joint diagonalization target
+    Cov_set = lagged_covariances(data, lags)
+    Cov_set = (Cov_set + np.conj(np.swapaxes(Cov_set, -1, -2))) / 2
 
-    for j in range(1, len(Cov_set)):
-        Sum_Cov = Sum_Cov + Cov_set[j]
+    # joint diagonalization of all time shifted covariances (Givens rotations, see joint_diag.py)
+    V, diagonalized, _ = joint_diagonalize(Cov_set, tol=1 / (np.sqrt(n_frames) * 1e2))
 
-    row = 0
-    column = 0
-
-    rotation_matrices = []
-
-    while row < len(Sum_Cov):
-
-        while column < row:
-            rotation_matrices.append(get_rotation_matrix(Sum_Cov, row, column))
-            column = column + 1
-
-        row = row + 1
-
-    reversed(rotation_matrices)
-    rotation_matrix = rotation_matrices[0]
-
-    for k in range(1, len(rotation_matrices)):
-        rotation_matrix = rotation_matrix * rotation_matrices[k]
-
-    return rotation_matrix
-
-
-def get_rotation_matrix(matrix, row, column):
-    """
-    gets the rotation matrix to set the Value [row][column] from a given matrix to zero by rotation
-    :param [[np.complex]] matrix: matrix to rotate
-    :param integer row: row of the value in the given matrix
-    :param integer column: columns of the value in the given matrix
-    :return: rotation matrix
-    """
-    length_matrix = len(matrix)
-    identity = np.identity(length_matrix, dtype=complex)
-
-    if matrix[row][column] == 0:
-        return identity
-    """
-    Berechnung D, c, s --> Mathematik 2.Auflage, (T.Ahres, H.Hettlich, Ch.Karpfinger), Spektrum Akademischer Verlag, S.612 
-    """
-    D = (matrix[row][row] - matrix[column][column]) / np.sqrt(
-        ((matrix[row][row] - matrix[column][column]) ** 2 + 4 * (matrix[row][column]) ** 2))
-    c = np.sqrt((1 + D) / 2)
-
-    if matrix[row][column] > 0:
-        s = np.sqrt((1 - D) / 2)
-    else:
-        s = -np.sqrt((1 - D) / 2)
-
-    R = identity
-
-    R[row][row], R[column][column] = c, c
-    R[row][column], R[column][row] = s, -s
-
-    return R
+    return np.conj(np.swapaxes(V, -1, -2)), np.diagonal(diagonalized, axis1=-2, axis2=-1).real
 
 
 def plot(t, f, Zxx):
@@ -248,50 +189,59 @@ def permutation_correction(covariance_matrices_matrix):
     https://www.crashkurs-statistik.de/der-korrelationskoeffizient-nach-pearson/
 
 
-    :param covariance_matrices_matrix: A 2-D list holding all diagonal covariance matrices. index 0 = Omega, index 1 = τ (tau) time point, index 2 = kth diagonal element of the corresponding matrix
+    :param covariance_matrices_matrix: A 2-D list or array (F, τ, n) holding all diagonal covariance matrices (e.g. the diagonals returned by SOBI). index 0 = Omega, index 1 = τ (tau) time point, index 2 = kth diagonal element of the corresponding matrix
     e.g. covariance_matrices_matrix[1][2][3] means the 3rd diagonal element of the Λ(ω=ω_k,τ=2) with k corresponding to the 2nd omega element of the list
     :type self: object
 
     Jonas Christiansen
     """
 
-    # Matrix erstellen für die jeweils besten normierte Korrelation pro Kreuzkombination aller Frequenzbänder - zunächst alle 0
-    num_freq_bands = len(covariance_matrices_matrix)
-    best_perm_matrix = np.zeros((num_freq_bands, num_freq_bands))
+    # Profile matrix (F * n, τ): one row per frequency band k and diagonal element q
+    profiles = normalized_profiles(covariance_matrices_matrix)
+    num_freq_bands, n, tau_value = profiles.shape
+    profiles = profiles.reshape(num_freq_bands * n, tau_value)
 
-    # Get highest tau value. should be equal across all those matrices, so:
-    tau_value = len(covariance_matrices_matrix[0])
+    # rho_q_p of every combination of omega_k, omega_j, q and p is an entry of the normalized Gram matrix
+    rho = np.dot(profiles, profiles.T).reshape(num_freq_bands, n, num_freq_bands, n)
 
-    # Calculate best Permutation for every combination of omega_k and omega_j by calculating every rho_q_p using formula
-    # and storing it in permutation matrix only if the newly calculated value is higher then a previous
-    # one stored in the permutationm matrix for this (k,j) combination
+    # best normalized correlation per combination of frequency bands, only positive values are stored (starts at 0)
+    best_perm_matrix = np.maximum(rho.max(axis=(1, 3)), 0)
 
-    for k in range(0, num_freq_bands):
-        for j in range(0, num_freq_bands):
+    return best_perm_matrix
 
-            for q in range(0, covariance_matrices_matrix[k][0]):
-                for p in range(0, covariance_matrices_matrix[j][0]):
 
-                    zaehler = 0
-                    for tau in range(0, tau_value):
-                        zaehler += (covariance_matrices_matrix[k][tau][q] * covariance_matrices_matrix[j][tau][p])
+def normalized_profiles(covariance_matrices_matrix):
+    """
+    profiles of the diagonal elements over τ, every profile normalized once (sqrt(sum1) and sqrt(sum2) of the correlation coefficient)
+    :param covariance_matrices_matrix: (F, τ, n) diagonals of the diagonalized covariance matrices, see permutation_correction
+    :return: array (F, n, τ), profiles without energy stay zero and correlate with nothing
+    """
+    profiles = np.asarray(covariance_matrices_matrix, dtype=float).transpose(0, 2, 1)
+    norms = np.linalg.norm(profiles, axis=2, keepdims=True)
 
-                    sum1 = 0
-                    for tau in range(0, tau_value):
-                        sum1 += covariance_matrices_matrix[k][tau][q] ** 2
+    return np.divide(profiles, norms, out=np.zeros_like(profiles), where=norms > 0)
 
-                    sum2 = 0
-                    for tau in range(0, tau_value):
-                        sum2 += covariance_matrices_matrix[j][tau][p] ** 2
 
-                    nenner = math.sqrt(sum1) * math.sqrt(sum2)
+def permutation_alignment(covariance_matrices_matrix):
+    """
+    Permutation of the demixed signals of every frequency band following the correlation-based method by Rahbar and Reilly:
+    the band with the highest correlation to all other bands (sum of a row of permutation_correction) is the reference,
+    the diagonal elements of every band are assigned to those of the reference with the highest sum of correlation coefficients
+    :param covariance_matrices_matrix: (F, τ, n) diagonals of the diagonalized covariance matrices, see permutation_correction
+    :return: integer array (F, n), row k lists the signals of band k in the order of the reference band
+    """
+    profiles = normalized_profiles(covariance_matrices_matrix)
+    n = profiles.shape[1]
+    reference = np.argmax(permutation_correction(covariance_matrices_matrix).sum(axis=1))
 
-                    rho_q_p = zaehler / nenner
+    # rho[k, q, p]: correlation of diagonal element q of band k with diagonal element p of the reference band
+    rho = np.matmul(profiles, profiles[reference].T)
 
-                    if (rho_q_p > best_perm_matrix[k][j]):
-                        best_perm_matrix[k][j] = rho_q_p
+    # all n! assignments (n = 2 channels here), candidate[p] is the signal of a band at position p of the reference
+    candidates = np.array(list(itertools.permutations(range(n))))
+    scores = rho[:, candidates, np.arange(n)].sum(axis=-1)
 
-    return best_perm_matrix
+    return candidates[np.argmax(scores, axis=1)]
 
 
 def entropy(x, num_bins):
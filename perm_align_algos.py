@@ -1,67 +1,70 @@
-from numpy.core.defchararray import index
-from numpy.core.fromnumeric import sort
-from scipy.stats import weibull_min, weibull_max, exponweib, entropy
+from scipy.special import rel_entr
+from weibull_fit import weibull_shape, weibull_pdf as weibull_pdf_grid
 import numpy as np
-import scipy.spatial.distance as sd
-from itertools import combinations, permutations
+
+def _normalize_pdf(P):
+    """
+    rows of P scaled to sum 1; non-finite values count as 0 and rows without mass (e.g. a silent band) become uniform
+    """
+    P = np.where(np.isfinite(P), P, 0)
+    total = P.sum(-1, keepdims=True)
+    return np.where(total > 0, P / np.where(total > 0, total, 1), 1 / P.shape[-1])
+
+def jensenshannon_matrix(P, Q=None):
+    """
+    Jensen-Shannon distances (as scipy.spatial.distance.jensenshannon) between all rows of P and Q
+
+    :param P: array, shape (n_p, n_points), distributions on a shared grid, normalized here (see _normalize_pdf)
+    :param Q: array, shape (n_q, n_points), P itself if None
+    :return: array, shape (n_p, n_q)
+    """
+    P = _normalize_pdf(P)
+    Q = P if Q is None else _normalize_pdf(Q)
+    M = (P[:, np.newaxis] + Q[np.newaxis]) / 2
+    js = (rel_entr(P[:, np.newaxis], M).sum(-1) + rel_entr(Q[np.newaxis], M).sum(-1)) / 2
+    return np.sqrt(np.maximum(js, 0))
+
+def closest_pair(D):
+    """
+    indices of the two different rows with the smallest distance in a symmetric distance matrix D,
+    NaN distances count as infinite (the first pair is returned if no distance is finite)
+    """
+    i, j = np.triu_indices(len(D), 1)
+    k = np.argmin(np.nan_to_num(D[i, j], nan=np.inf))
+    return [i[k], j[k]]
 
 #permutation alginment alogrithm 1 from Eugen Hoffmann (page 60)
 def perm_al_hof_alg1(Sources):
     #norm the source vectors
     norm_X = np.abs(Sources)
 
+    if len(Sources) < 2:
+        return list(Sources)
+
+    #estimate weibull parameters with MLE for all frequency bands at once, pdfs on the shared grid
+    weibull_pdf = weibull_pdf_grid(weibull_shape(norm_X))
+
+    #Jensen-Shannon divergence of all pairs of frequency bands, the two closest ones are corrected first
+    order = closest_pair(jensenshannon_matrix(weibull_pdf))
+    remaining = np.ones(len(Sources), dtype=bool)
+    remaining[order] = False
+
+    #mean for all corrected power density functions
+    Weibull_mean = weibull_pdf[order].mean(axis=0)
+
+    while remaining.any():
+        #only the mean has changed, so only the distances of the rest of frequency pdfs to the mean are needed
+        rest = np.flatnonzero(remaining)
+        x_distance = jensenshannon_matrix(Weibull_mean[np.newaxis], weibull_pdf[rest])[0]
+
+        #add the frequency bin with the shortest distance to the corrected frequencys and update the mean
+        k = rest[np.argmin(np.nan_to_num(x_distance, nan=np.inf))]
+        order.append(k)
+        remaining[k] = False
+        Weibull_mean += (weibull_pdf[k] - Weibull_mean) / len(order)
+
     #Permuted source signals
-    P = []
-    
-    #List of weibull parameters
-   
-    weibull_pdf = []
-
-    #estimate weibull parameters with MLE 
-    for i in range(len(Sources)):
-        b = weibull_min.fit(norm_X[i],floc = 0, fscale = 1) #estimate weibull parameters for all frequency bands
-        weibull_pdf.append(weibull_min.pdf(norm_X[i],b[0]))
-
-    #calculate all permutations for weibull distributions of the frequency bands
-    Permutations = list(permutations(weibull_pdf,r=2))
-
-    #Calculate Jensen-Shannon divergence for every permutation
-    Distances = []
-
-    for j in range(len(Permutations)):
-        Distances.append(sd.jensenshannon(Permutations[j][0],Permutations[j][1])) 
-    
-    #Sort for lowest to largest and remove duplicates
-    Distances_sorted = list(dict.fromkeys(sort(Distances)))
-
-    P_weib = Permutations[Distances.index(Distances_sorted[0])]
-    
-    Pdf_count = weibull_pdf
-
-    #Remove corrected frequency bins from Pdf_count
-    for k in range(len(P_weib)):
-        Pdf_index_1 = np.where(np.all(weibull_pdf==(P_weib[k]), axis = 1))
-        Pdf_count.pop(Pdf_index_1[0][0])
-    
-    l = len(Pdf_count)
-    while l > 0:
-        #mean for all power density functions
-        Weibull_mean = [np.mean(P_weib, axis=0)]
-        
-        #calculate all combinations of mean and the rest of frequency pdfs
-        all_combinations = Pdf_count
-        for m in range(len(Pdf_count)):
-            all_combinations.append(Weibull_mean[0])
-
-        #get shortest distance and add frequency bin to corrected frequencys
-        x_distance = []
-        for n in range(len(all_combinations)):
-           x_distance.append(sd.jensenshannon(all_combinations[n][0],all_combinations[n][1]))
-
-        x_sorted = list(dict.fromkeys(sort(x_distance)))
-        P_weib.append(all_combinations[x_distance.index[x_sorted[1]]])
-
-        l = l - 1 
+    P = [Sources[k] for k in order]
 
     return P
 
@@ -70,50 +73,36 @@ def perm_al_hof_alg2(Sources):
 
     #norm the source vectors
     norm_X = np.abs(Sources) 
-    
-    #estimate weibull parameters for normed sources
-    weibull_pdf =[] 
 
-    #estimate weibull parameters with MLE 
-    for i in range(len(Sources)):
-        b = weibull_min.fit(norm_X[i],floc = 0, fscale = 1) #estimate weibull parameters for all frequency bands
-        weibull_pdf.append(weibull_min.pdf(norm_X[i],b[0]))
+    if len(Sources) < 2:
+        return list(Sources)
 
-    #calculate all permutations for weibull distributions of the frequency bands
-    Permutations = list(permutations(weibull_pdf,r=2))
+    #estimate weibull parameters with MLE for all frequency bands at once, pdfs on the shared grid
+    weibull_pdf = weibull_pdf_grid(weibull_shape(norm_X))
 
-    #Calculate Jenson-Shannon divergence for every permutation (includes 'AB' 'BA') - Wie bestimmt man die richtige Reihenfolge? Symmetrisches Maß, unterscheidung nicht möglich?
-    Distances_start = []
-    for j in range(len(Permutations)):
-        Distances_start.append(sd.jensenshannon(Permutations[j][0],Permutations[j][1]))
+    #Get the two closest frequency bands (Jensen-Shannon divergence) to use them as a start 
+    order = closest_pair(jensenshannon_matrix(weibull_pdf))
+    remaining = np.ones(len(Sources), dtype=bool)
+    remaining[order] = False
 
-    #Sort for lowest to largest and remove duplicates
-    Distances_sorted = list(dict.fromkeys(sort(Distances_start)))
-
-    #Get the two closest frequency bands to use them as a start 
-    B = Permutations[Distances_start.index(Distances_sorted[0])]
-    Sources_norm = [norm_X[weibull_pdf.index(B[0])],norm_X[weibull_pdf.index(B[1])]]
+    #mean of the normed sources of the corrected frequency bands
+    bands = norm_X[order].mean(axis=0)
 
     #Calculate permutations for mean of corrected frquency bands
-    for k in range(len(Sources)-2):
-
-        #get the mean of corrected frequency bands
-        bands = np.mean(Sources_norm, axis = 1)
+    while remaining.any():
 
         #calculate the weibull parameters for the mean
-        b = weibull_min.fit(bands,floc = 0, fscale = 1)
-        weibull_1 = weibull_min.pdf(bands,b[0])
+        weibull_1 = weibull_pdf_grid(weibull_shape(bands))
 
         #calculate the Jensen-Shannon divergence and look for the closest frequency band and add it to the corrected batch
-        ent = []
-        for l in range(len(a)):
-            ent.append(sd.jensenshannon(a[l],weibull_1))
+        rest = np.flatnonzero(remaining)
+        ent = jensenshannon_matrix(weibull_1[np.newaxis], weibull_pdf[rest])[0]
 
-        ent_sorted = list(dict.fromkeys(sort(ent)))
-        #permutations of a and weibull_1
-        Sort_frq = ent.index(ent_sorted[0])
-        Sources_norm.append(norm_X[Sort_frq])
+        k = rest[np.argmin(np.nan_to_num(ent, nan=np.inf))]
+        order.append(k)
+        remaining[k] = False
+        bands += (norm_X[k] - bands) / len(order)
 
-    P = []
+    P = [Sources[k] for k in order]
 
     return P
@@ -0,0 +1,130 @@
+from functools import lru_cache
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import get_window, stft
+
+
+"""
+Overlapping segmentation of recordings without copies.
+
+segment returns a read-only strided view of the signal, so cutting a recording into segments costs nothing.
+A window is only applied on request, in a single broadcast over all segments, which is then the only copy.
+Windows are cached per (name, length). iter_segments cuts a stream of sample chunks into the same segments lazily.
+"""
+
+
+@lru_cache(maxsize=32)
+def _cached_window(name, n):
+    win = get_window(name, n, fftbins=False)
+    win.flags.writeable = False
+    return win
+
+
+def _window(window, n):
+    if isinstance(window, str):
+        return _cached_window(window, n)
+    window = np.asarray(window)
+    if window.shape != (n,):
+        raise ValueError('window must have the segment length %d' % n)
+    return window
+
+
+def segment(data, n, overlap, window=None):
+    """
+    splits a signal into segments of n values, consecutive segments share overlap values
+
+    :param data: array-like, shape (..., n_samples), e.g. a list of samples
+    :param integer n: length of a segment
+    :param integer overlap: length of the overlap, the segments start every n - overlap samples
+    :param window: None returns a read-only view of data, a window name (e.g. 'bartlett') or an array of length n
+                   multiplies every segment in one broadcast
+    :return: array, shape (..., n_segments, n); the last samples are dropped if they are not long enough for a segment
+    """
+    step = n - overlap
+    if step <= 0:
+        raise ValueError('overlap must be shorter than the segment length')
+
+    data = np.asarray(data)
+    if data.shape[-1] < n:
+        segments = np.zeros(data.shape[:-1] + (0, n), dtype=data.dtype)
+    else:
+        segments = sliding_window_view(data, n, axis=-1)[..., ::step, :]
+
+    if window is None:
+        return segments
+    return segments * _window(window, n)
+
+
+def iter_segments(chunks, n, overlap, window=None):
+    """
+    lazy form of segment for streams: yields every segment as soon as its last sample has arrived
+
+    :param chunks: iterable of sample chunks (1-D array-likes of any length)
+    :param integer n, overlap: see segment
+    :param window: see segment
+    :return: generator of segments, arrays of shape (n,); read-only views of the stream if window is None
+    """
+    step = n - overlap
+    if step <= 0:
+        raise ValueError('overlap must be shorter than the segment length')
+    win = None if window is None else _window(window, n)
+
+    buffer = None
+    skip = 0
+    for chunk in chunks:
+        chunk = np.asarray(chunk).ravel()
+        # with overlap < 0 the samples between two segments are dropped, also across chunk borders
+        dropped = min(skip, len(chunk))
+        skip -= dropped
+        chunk = chunk[dropped:]
+        buffer = chunk.copy() if buffer is None else np.concatenate((buffer, chunk))
+        buffer.flags.writeable = False
+
+        n_segments = (len(buffer) - n) // step + 1 if len(buffer) >= n else 0
+        for i in range(n_segments):
+            seg = buffer[i * step:i * step + n]
+            yield seg if win is None else seg * win
+
+        # keep the samples the next segment starts with
+        start = n_segments * step
+        skip += max(start - len(buffer), 0)
+        buffer = buffer[start:]
+
+
+def stft_segments(data, fs, n, overlap, nperseg=32, noverlap=24, window='bartlett'):
+    """
+    STFT of overlapping segments (as signal.stft(segment(data, n, overlap, window), fs, nperseg=nperseg, noverlap=noverlap))
+    from a single STFT of the whole recording: the frames of a segment are a window of the frames of the recording.
+
+    The segment window is applied in the frame domain, every frame is weighted with the window value at its center.
+    This is exact for constant windows and a close approximation for windows that are smooth on the scale of nperseg
+    (like the Bartlett window of a segment that is much longer than a frame).
+
+    :param data: array-like, shape (..., n_samples)
+    :param fs: sampling frequency
+    :param integer n, overlap: segment length and overlap in samples, see segment; n - overlap must be a multiple
+                               of the STFT hop nperseg - noverlap
+    :param integer nperseg, noverlap: see signal.stft
+    :param window: window of the segments, see segment; None returns read-only views of the frames of the recording
+                   (the first and last two frames of a segment then also see the samples next to the segment)
+    :return: frequencies f, frame times t within a segment, Zxx of shape (..., n_segments, len(f), len(t))
+    """
+    data = np.asarray(data)
+    hop = nperseg - noverlap
+    if (n - overlap) % hop or n % hop:
+        raise ValueError('segment length and segment step must be multiples of the STFT hop %d' % hop)
+
+    f, t, Zxx = stft(data, fs, nperseg=nperseg, noverlap=noverlap)
+
+    # frames of a segment are centered at 0, hop, ..., n (zero padded beyond the segment like the segment STFT)
+    frames_per_segment = n // hop + 1
+    n_segments = max((data.shape[-1] - n) // (n - overlap) + 1, 0)
+    Zxx = segment(Zxx, frames_per_segment, frames_per_segment - (n - overlap) // hop)[..., :n_segments, :]
+    Zxx = np.moveaxis(Zxx, -2, -3)
+
+    if window is None:
+        return f, t[:frames_per_segment], Zxx
+
+    centers = np.arange(frames_per_segment) * hop
+    weights = np.interp(centers, np.arange(n), _window(window, n), right=0)
+    return f, t[:frames_per_segment], Zxx * weights
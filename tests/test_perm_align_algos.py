@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from perm_align_algos import closest_pair, jensenshannon_matrix, perm_al_hof_alg1, perm_al_hof_alg2
+
+
+def _sources(n=5, p=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((n, p)) + 1j * rng.standard_normal((n, p))
+
+
+def _order(Sources, P):
+    # index of every returned row in Sources
+    return [next(k for k in range(len(Sources)) if P[i] is Sources[k]) for i in range(len(P))]
+
+
+def test_jensenshannon_matrix_zero_rows_are_finite():
+    P = np.array([[0., 0., 0.], [1., 2., 3.], [np.nan, 1., 1.]])
+    D = jensenshannon_matrix(P)
+    assert np.isfinite(D).all()
+    assert np.allclose(np.diag(D), 0)
+
+
+def test_closest_pair_ignores_nan_and_diagonal():
+    D = np.full((4, 4), np.nan)
+    D[2, 3] = D[3, 2] = .5
+    assert sorted(closest_pair(D)) == [2, 3]
+    i, j = closest_pair(np.full((3, 3), np.nan))
+    assert i != j
+
+
+@pytest.mark.parametrize('align', [perm_al_hof_alg1, perm_al_hof_alg2])
+def test_degenerate_band_gives_permutation(align):
+    Sources = list(_sources())
+    Sources[0] = np.zeros_like(Sources[0])
+    order = _order(Sources, align(Sources))
+    assert sorted(order) == list(range(len(Sources)))
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from segmenter import iter_segments, segment
+
+
+def _chunks(data, sizes):
+    bounds = np.cumsum([0] + list(sizes))
+    return [data[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+@pytest.mark.parametrize('n, overlap', [(5, 2), (4, 0), (4, -2), (3, -7)])
+@pytest.mark.parametrize('window', [None, 'bartlett'])
+def test_iter_segments_matches_segment_on_uneven_chunks(n, overlap, window):
+    data = np.arange(103, dtype=float)
+    sizes = [1, 0, 7, 2, 13, 1, 1, 30, 4, 44]
+    streamed = list(iter_segments(_chunks(data, sizes), n, overlap, window))
+    expected = segment(data, n, overlap, window)
+    assert len(streamed) == len(expected)
+    assert np.allclose(streamed, expected)
@@ -2,6 +2,7 @@ import csv
 import numpy as np
 import scipy as sp
 import matplotlib.pyplot as plt
+from segmenter import segment
 
 
 # Added from RSCD
@@ -28,23 +29,15 @@ def import_data(data):
 
 def overlap_add(data, n=256, overlap=128):
     """
-    Decomposition of Data in segments of n = 512 Values with an overlap = 256. Each segment gets multiplied by a bartlett-window.
+    Decomposition of Data in segments of n = 256 Values with an overlap = 128. Each segment gets multiplied by a bartlett-window.
 
     :param [float] data: imported time-signals
     :param integer n: Length of Segment
     :param integer overlap: length of overlap
-    :return: array of segments
+    :return: array of segments, shape (n_segments, n)
     """
-    segments = []
-
-    for i in range(0, len(data), n - overlap):
-
-        if i + n > len(data):  # cuts the last signals from the data, if they are not long enough, for a segment.
-            break
-
-        segment = data[i:i + n]
-        segment = segment * np.bartlett(n)
-        segments.append(segment)
+    # strided view of the data, the (cached) window is applied to all segments at once
+    segments = segment(data, n, overlap, window='bartlett')
 
     return segments
 
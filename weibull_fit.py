@@ -0,0 +1,66 @@
+import warnings
+import numpy as np
+
+
+"""
+Weibull models of the source magnitudes used by the permutation alignment.
+
+The location is fixed to 0 and the scale to 1 (like weibull_min.fit(x, floc=0, fscale=1)), so only the
+shape k is estimated. Its log-likelihood is concave in k, so a few vectorized Newton steps give the MLE
+of every frequency band at once. The pdfs are evaluated on one fixed grid, so every band is described by a
+vector of the same length and the bands can be compared directly.
+"""
+
+#shared evaluation grid of the magnitudes (cell midpoints, so x = 0 is never evaluated)
+N_GRID = 128
+X_MAX = 4.
+GRID = (np.arange(N_GRID) + .5) * X_MAX / N_GRID
+
+
+def weibull_shape(X, max_iter=20, tol=1e-8):
+    """
+    maximum likelihood estimate of the Weibull shape k with loc = 0 and scale = 1
+
+    :param X: array, shape (..., n_samples), positive samples (e.g. |S|) of every band along the last axis
+    :param integer max_iter: maximum number of Newton steps
+    :param float tol: the iteration stops when every relative step is smaller than tol
+    :return: shape parameters k, array of shape (...)
+    """
+    logX = np.log(np.maximum(np.abs(X), np.finfo(float).tiny))
+    n = logX.shape[-1]
+    sum_log = logX.sum(-1)
+
+    #start from the moment estimate std(log x) = pi / (k sqrt(6))
+    k = np.pi / (np.sqrt(6) * np.maximum(logX.std(-1), np.finfo(float).eps))
+
+    for n_iter in range(max_iter):
+        Xk = np.exp(k[..., np.newaxis] * logX)
+        XkL = Xk * logX
+
+        #first and second derivative of the log-likelihood n log k + (k - 1) sum log x - sum x^k
+        dL = n / k + sum_log - XkL.sum(-1)
+        ddL = -n / k ** 2 - (XkL * logX).sum(-1)
+
+        #Newton step, at most halving k to stay positive
+        k_new = np.maximum(k - dL / ddL, k / 2)
+        step = np.abs(k_new - k)
+        k = k_new
+        if (step <= tol * k).all():
+            break
+
+    else:
+        warnings.warn('Weibull fit did not converge. Consider increasing the maximum number of iterations.')
+
+    return k
+
+
+def weibull_pdf(k, grid=GRID):
+    """
+    pdf k x^(k-1) exp(-x^k) of the Weibull distributions with shapes k on a shared grid
+
+    :param k: shape parameters, array of shape (...)
+    :param grid: array, shape (n_points,), points to evaluate the pdfs at
+    :return: array, shape (..., n_points)
+    """
+    k = np.asarray(k, dtype=float)[..., np.newaxis]
+    return k * grid ** (k - 1) * np.exp(-grid ** k)
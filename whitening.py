@@ -0,0 +1,133 @@
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+
+"""
+Covariance based whitening shared by the ICA algorithms.
+
+All algorithms work on tall data (few channels n, many samples p), so the n x n Hermitian
+covariance is formed once (O(n^2 p)) and decomposed with eigh instead of taking an SVD of the data.
+Every function accepts a single (n, p) matrix or a stack of shape (..., n, p).
+
+Eigendecompositions of read-only inputs (e.g. strided segment views of a read-only spectrogram)
+are cached keyed on the identity of the input buffer, so algorithms whitening the same data reuse them.
+An input is only cached if the whole chain of bases down to the buffer is read-only: writeable inputs,
+and read-only views of writeable arrays, could be changed in place between calls.
+Cached results are stored read-only and handed out as copies.
+"""
+
+_CACHE_SIZE = 16
+_cache = OrderedDict()
+
+
+def _root_base(X):
+    while isinstance(X, np.ndarray) and X.base is not None:
+        X = X.base
+    return X
+
+
+def _is_frozen(X):
+    """True if neither X nor any of its bases can be written to"""
+    while isinstance(X, np.ndarray):
+        if X.flags.writeable:
+            return False
+        if X.base is None:
+            return True
+        X = X.base
+    # foreign buffers (e.g. shared memory) may be written through other handles
+    return isinstance(X, bytes)
+
+
+def _cache_key(X):
+    if not _is_frozen(X):
+        return None
+    return (X.__array_interface__['data'][0], X.shape, X.strides, X.dtype.str)
+
+
+def _freeze(*arrays):
+    for arr in arrays:
+        arr.flags.writeable = False
+    return arrays
+
+
+def covariance_eigh(X, ddof=0, cache=True):
+    """
+    eigendecomposition of the Hermitian covariance of the rows of X
+
+    :param X: array, shape (..., n, p), n channels with p samples each
+    :param ddof: the covariance is normalized by p - ddof (0 like the FastICA SVD, 1 like np.cov)
+    :param cache: reuse the result for the same read-only buffer (see the module docstring)
+    :return: X_mean (..., n), eigenvalues d (..., n) in ascending order, eigenvectors E (..., n, n)
+    """
+    X = np.asarray(X)
+    p = X.shape[-1]
+    key = _cache_key(X) if cache else None
+    if key is not None and key in _cache:
+        ref, (X_mean, d, E) = _cache[key]
+        if ref() is not None:
+            _cache.move_to_end(key)
+            return X_mean.copy(), d / (p - ddof), E.copy()
+        del _cache[key]
+
+    # the eigendecomposition of the scatter matrix serves every ddof
+    X_mean = X.mean(axis=-1)
+    Xc = X - X_mean[..., np.newaxis]
+    d, E = np.linalg.eigh(np.matmul(Xc, np.conj(Xc.swapaxes(-1, -2))))
+
+    if key is not None:
+        try:
+            ref = weakref.ref(_root_base(X))
+        except TypeError:
+            ref = None
+        if ref is not None:
+            _cache[key] = (ref, _freeze(X_mean.copy(), d, E.copy()))
+            if len(_cache) > _CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    return X_mean, d / (p - ddof), E
+
+
+def whitening_matrix(X, n_components=None, method='pca', ddof=0, cache=True):
+    """
+    whitening matrix K with K C K^H = I for the covariance C of the rows of X
+
+    :param X: array, shape (..., n, p)
+    :param n_components: number of principal components to keep (method='pca' only), None keeps all
+    :param method: 'pca' gives K = D^(-1/2) E^H with the rows sorted by decreasing variance,
+                   'zca' gives the symmetric K = E D^(-1/2) E^H = C^(-1/2)
+    :param ddof: see covariance_eigh
+    :param cache: see covariance_eigh
+    :return: K (..., n_components, n), its (pseudo-)inverse IK (..., n, n_components), X_mean (..., n)
+    """
+    X_mean, d, E = covariance_eigh(X, ddof, cache)
+    d = np.maximum(d, np.finfo(d.dtype).eps * d.max(axis=-1, keepdims=True))
+    EH = np.conj(E.swapaxes(-1, -2))
+
+    if method == 'pca':
+        d, E, EH = d[..., ::-1], E[..., ::-1], EH[..., ::-1, :]
+        if n_components is not None:
+            d, E, EH = d[..., :n_components], E[..., :n_components], EH[..., :n_components, :]
+        K = EH / np.sqrt(d)[..., np.newaxis]
+        IK = E * np.sqrt(d)[..., np.newaxis, :]
+    elif method == 'zca':
+        K = np.matmul(E / np.sqrt(d)[..., np.newaxis, :], EH)
+        IK = np.matmul(E * np.sqrt(d)[..., np.newaxis, :], EH)
+    else:
+        raise ValueError("method must be 'pca' or 'zca'")
+
+    return K, IK, X_mean
+
+
+def whiten(X, n_components=None, method='pca', ddof=0, cache=True):
+    """
+    centers and whitens the rows of X
+
+    :param X: array, shape (..., n, p)
+    :param n_components, method, ddof, cache: see whitening_matrix
+    :return: whitened data Xw = K (X - X_mean) (..., n_components, p), K, IK, X_mean
+    """
+    X = np.asarray(X)
+    K, IK, X_mean = whitening_matrix(X, n_components, method, ddof, cache)
+    Xw = np.matmul(K, X - X_mean[..., np.newaxis])
+    return Xw, K, IK, X_mean